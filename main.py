@@ -1,4 +1,7 @@
+import multiprocessing
+
 import rowdo
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # Worker and image processes of a frozen executable start here.
     rowdo.start()
@@ -4,6 +4,7 @@ import sys
 import rowdo.database
 import rowdo.watcher
 import rowdo.config
+import rowdo.metrics
 from rowdo.logging import logger, start_log_file
 
 WATCHER_INSTANCE = None
@@ -24,7 +25,23 @@ def run():
         logger.debug(err)
         sys.exit('DB Error')
 
-    WATCHER_INSTANCE = rowdo.watcher.Watcher(db)
+    if rowdo.config.get('metrics', 'enabled'):
+        try:
+            rowdo.metrics.start_server(rowdo.config.get('metrics', 'host'), rowdo.config.get('metrics', 'port'))
+        except OSError as err:
+            logger.error(f'Metrics server could not start, continuing without it. {err}')
+
+    if rowdo.config.get('runtime', 'engine') == 'async':
+        try:
+            import rowdo.aio
+        except ImportError as err:
+            logger.error('Async engine requires aiohttp. Install it or set runtime.engine = sync in config.ini.')
+            logger.debug(err)
+            sys.exit('Engine Error')
+
+        WATCHER_INSTANCE = rowdo.aio.AsyncWatcher(db)
+    else:
+        WATCHER_INSTANCE = rowdo.watcher.Watcher(db)
     # watcher.routine()
     WATCHER_INSTANCE.loop()
 
@@ -41,7 +58,10 @@ def start(working_directory=None):
     elif working_directory:  # Called by sys.argv[0] real cwd in service mode.
         os.chdir(os.path.dirname(working_directory))
 
+    rowdo.config.load()  # First read from the launch directory, when rowdo.logging was imported.
+
     start_log_file()
+    rowdo.config.install_reload_signal()
 
     if rowdo.config.get('runtime', 'debug'):
         debug()
@@ -0,0 +1,294 @@
+import os
+import asyncio
+import contextvars
+from time import perf_counter
+from types import SimpleNamespace
+from functools import partial
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+
+from rowdo.logging import logger
+import rowdo.config as config
+import rowdo.database
+import rowdo.exceptions as exceptions
+import rowdo.cache
+import rowdo.http_session
+import rowdo.metrics
+import rowdo.timing
+import rowdo.lease
+from rowdo.watcher import Watcher, WORKER_PROCESS, keeping_error
+from rowdo.hosts import BACKOFF_STATUSES
+
+
+class AsyncWatcher(Watcher):
+    """Watcher running downloads concurrently on a single asyncio event loop.
+
+    Network I/O stays on the event loop. Database access, resizing and saving run in a thread pool
+    of config.runtime.workers threads through the same code paths as Watcher.
+    """
+    def __init__(self, db: rowdo.database.Database):
+        self.client = None
+        self._semaphore = None
+        self._fetched = {}  # Row id -> fetched file info or RowdoException, consumed by download_file.
+
+        super().__init__(db)
+        if self.worker_type == WORKER_PROCESS:
+            logger.warning('Async engine runs blocking work in threads, worker_type = process is ignored.')
+
+        self.concurrency = config.get('runtime', 'async_concurrency')
+
+    def configure(self):
+        super().configure()
+        self.retries = config.get('download', 'retries')
+        self.retry_backoff = config.get('download', 'retry_backoff')
+        self.retry_statuses = rowdo.http_session.retry_statuses()
+
+    def get_executor(self):
+        if not self._executor:
+            logger.debug(f'Starting {self.workers} async engine worker threads.')
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='rowdo-worker')
+
+        return self._executor
+
+    def create_client(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency,
+            limit_per_host=config.get('download', 'pool_maxsize'),
+            force_close=not config.get('download', 'keep_alive')
+        )
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=config.get('download', 'connect_timeout'),
+            sock_read=config.get('download', 'read_timeout')
+        )
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def run_blocking(self, func, *args):
+        """Run func in a worker thread, in a copy of the task's context so the row timer follows it.
+        """
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self.get_executor(), partial(context.run, func, *args))
+
+    def loop(self):
+        asyncio.run(self.loop_async())
+        self.shutdown_workers()
+        self.http.close()
+
+    @asynccontextmanager
+    async def running(self):
+        """Download slots and HTTP client of the event loop, routines run inside.
+        """
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self.create_client() as client:
+            self.client = client
+            yield
+
+    async def loop_async(self):
+        async with self.running():
+            while self.keep_loop:
+                self.refresh_config()
+                await self.routine_async()
+                for i in range(config.get('runtime', 'run_every_seconds') * 10):
+                    await asyncio.sleep(0.1)
+
+    async def routine_async(self):
+        with rowdo.metrics.ROUTINE_SECONDS.time():
+            await self.run_routine_async()
+
+    async def run_routine_async(self):
+        logger.debug('Running async routine.')
+        await self.run_blocking(self.observe_queue)
+        await self.run_blocking(self.db.recover_stale_claims)
+        await self.run_blocking(self.db.refresh_presets)
+        cursor, until = await self.run_blocking(self.start_cursor)
+
+        while self.keep_loop:
+            snapshots, page_cursor = await self.run_blocking(self.claim_row_snapshots, cursor, until)
+            if not page_cursor:
+                break
+
+            logger.debug(f'Claimed {len(snapshots)} rows.')
+            await self.process_rows_async(snapshots)
+            cursor = page_cursor
+            await self.run_blocking(self.finish_batch, cursor)
+
+    async def process_rows_async(self, snapshots):
+        """Start row groups as the host scheduler allows, like process_rows, up to async_concurrency at a time.
+        """
+        pending = self.hosts.interleave((self.group_host(group), group) for group in self.group_rows(snapshots))
+        running = {}  # Task -> host
+        while pending or running:
+            pair, wait, blocked = self.next_group(pending, len(running), self.concurrency)
+            if pair:
+                running[asyncio.ensure_future(self.handle_row_group_async(pair[1]))] = pair[0]
+                continue
+
+            if blocked:
+                await self.run_blocking(self.defer_rows, blocked)
+            if running:
+                done, _ = await asyncio.wait(running, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    self.group_done(running.pop(task), task.result())
+            elif pending:
+                await asyncio.sleep(wait or 0.1)
+
+        self.hosts.prune()
+
+    def claim_row_snapshots(self, cursor, until):
+        """Claim a page of rows and detach their values from the worker thread's session.
+        """
+        try:
+            rows, page_cursor = self.claim_rows(cursor, until)
+            snapshots = [
+                SimpleNamespace(**{column.name: getattr(row, column.name) for column in row.__table__.columns})
+                for row in rows
+            ]
+            return snapshots, page_cursor
+        finally:
+            self.db.close_session()
+
+    async def handle_row_group_async(self, rows):
+        """Rows downloading the same URL run one after another and share the first fetched body, as in handle_row_group.
+        """
+        if len(rows) == 1:
+            return await self.handle_row_async(rows[0])
+
+        with self.sharing_fetch(rows):
+            for row in rows:
+                await self.handle_row_async(row)
+
+    async def handle_row_async(self, row):
+        token = rowdo.timing.activate(super().get_row_timer(row))  # Sampled once, for the fetch and handle_row.
+        lease_token = rowdo.lease.activate(rowdo.lease.ClaimLease(self.db, row))
+        try:
+            if row.command == rowdo.database.COMMAND_DOWNLOAD:
+                async with self._semaphore:
+                    try:
+                        self._fetched[row.id] = await self.fetch_file_async(row)
+                    except exceptions.RowdoException as exc:
+                        self._fetched[row.id] = exc
+
+            await self.run_blocking(self.process_row_id, row.id)
+        finally:
+            rowdo.lease.deactivate(lease_token)
+            rowdo.timing.deactivate(token)
+            fetched = self._fetched.pop(row.id, None)  # Left over if claim was lost.
+            if isinstance(fetched, dict) and os.path.exists(fetched['temp_path']):
+                os.remove(fetched['temp_path'])
+
+    def get_row_timer(self, row):
+        return rowdo.timing.current()
+
+    def download_file(self, row):
+        if row.id not in self._fetched:
+            return super().download_file(row)
+
+        fetched = self._fetched.pop(row.id)
+        if isinstance(fetched, exceptions.RowdoException):
+            raise fetched
+
+        if not fetched:
+            return
+
+        return self.store_file(row, fetched)
+
+    async def fetch_file_async(self, row):
+        """fetch_file with the request on the event loop.
+        """
+        shared = self.get_shared_fetch(row)
+        if shared and shared.path:
+            return await self.run_blocking(self.fetch_shared, row, shared)
+
+        with keeping_error(shared):
+            fetched = await self.request_file_async(row)
+
+        if shared and fetched:
+            await self.run_blocking(shared.keep, fetched['temp_path'], fetched['headers'])
+
+        return fetched
+
+    async def request_file_async(self, row):
+        """request_file with the requests and the body on the event loop, files and the cache in worker threads.
+        """
+        plan = await self.run_blocking(self.plan_request, row)
+        if plan.fresh:
+            return await self.run_blocking(self.fetch_from_cache, row, plan.entry)
+
+        if self.head_check:
+            self.check_downloadable(row, await self.head_content_type_async(row.url))
+
+        started = perf_counter()
+        with rowdo.timing.stage('request'):
+            req = await self.do_request_async(row.url, headers=plan.headers)
+        try:
+            fetched, streamed = await self.run_blocking(self.read_response, plan, req, req.status)
+            if not streamed:
+                return fetched
+
+            with rowdo.timing.stage('download'):
+                fetched['temp_path'] = await self.stream_to_file_async(req, os.path.dirname(fetched['full_path']), row.url, plan.digest, plan.part)
+        finally:
+            req.close()
+
+        return await self.run_blocking(self.finish_fetch, plan, fetched, req.headers, started)
+
+    async def head_content_type_async(self, url):
+        with rowdo.timing.stage('head'):
+            head = await self.do_request_async(url, method='HEAD')
+            head.release()
+
+        return head.headers.get('content-type')
+
+    async def do_request_async(self, url, method='GET', headers=None):
+        delay = 0
+        for attempt in range(self.retries + 1):
+            await asyncio.sleep(delay)
+            delay = self.retry_backoff * (2 ** attempt)
+            try:
+                req = await self.client.request(method, url, headers=headers, allow_redirects=True)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt < self.retries:
+                    continue
+                raise exceptions.RequestError('Request Exception. Make sure URL is correct.', level=exceptions.WARNING)
+
+            if req.status in self.retry_statuses and attempt < self.retries:
+                req.release()
+                continue
+
+            retry_after = rowdo.http_session.parse_retry_after(req.headers.get('Retry-After'))
+            if req.status in BACKOFF_STATUSES:
+                self.hosts.backoff(url, retry_after)
+
+            if req.status >= 400:
+                req.release()
+                raise exceptions.RequestError('HTTP returned non 200 code. Make sure url is correct.', level=exceptions.WARNING, retry_after=retry_after)
+
+            self.hosts.succeeded(url)
+            return req
+
+    async def keep_lease_async(self):
+        """Renew the current row's lease if it is due, with the database used from a worker thread.
+        """
+        lease = rowdo.lease.current()
+        if lease and lease.due():
+            await self.run_blocking(lease.renew)
+
+    async def open_temp_file_async(self, req, path_dirname, url, digest, part):
+        """open_temp_file, in a worker thread when a resumed download's kept part has to be read and hashed.
+        """
+        if part:
+            return await self.run_blocking(self.open_temp_file, req, req.status, path_dirname, url, digest, part)
+
+        return self.open_temp_file(req, req.status, path_dirname, url, digest, part)
+
+    async def stream_to_file_async(self, req, path_dirname, url, digest=None, part=None):
+        """stream_to_file reading the body on the event loop.
+        """
+        with self.receiving_body(req, path_dirname, url, digest, part, (aiohttp.ClientError, asyncio.TimeoutError)) as body:
+            body.open(*await self.open_temp_file_async(req, path_dirname, url, digest, part))
+            async for chunk in req.content.iter_chunked(self.chunk_size):
+                await self.keep_lease_async()
+                body.write(chunk)
+
+        return body.path
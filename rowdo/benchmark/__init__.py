@@ -0,0 +1,345 @@
+import os
+import sys
+import json
+import math
+import asyncio
+import warnings
+import configparser
+import multiprocessing
+from time import perf_counter
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy.exc import SAWarning
+
+from rowdo.logging import logger
+import rowdo.config as config
+import rowdo.database
+import rowdo.timing
+import rowdo.benchmark.sqlite
+from rowdo.benchmark.server import SyntheticServer
+
+
+MAX_PASSES = 10  # Routines run per scenario before rows still waiting are given up on.
+
+RESIZE_SCENARIOS = {
+    'resize_passthrough': {'resize_mode': rowdo.database.RESIZE_PASSTHROUGH},
+    'resize_ratio': {'resize_mode': rowdo.database.RESIZE_RATIO, 'resize_ratio': 0.5},
+    'resize_dimensions': {'resize_mode': rowdo.database.RESIZE_DIMENSIONS, 'resize_width': 320, 'resize_height': 240},
+    'resize_variants': {'resize_mode': rowdo.database.RESIZE_NONE, 'resize_variants': '160,320,640'}
+}
+
+
+def claim_rows(base_url, options):
+    """Idle rows, only claimed and marked done: the poll, claim and write path without any download.
+    """
+    return [{'url': f'{base_url}/binary/1/{i}.bin', 'command': rowdo.database.COMMAND_IDLE} for i in range(options['rows'])]
+
+
+def download_rows(base_url, options):
+    return [{
+        'url': f'{base_url}/binary/{options["binary_size"]}/{i}.bin',
+        'filename': f'download/{i}.bin'
+    } for i in range(options['rows'])]
+
+
+def duplicate_rows(base_url, options):
+    """Rows downloading the same URL are next to each other, so they are claimed in the same batch.
+    """
+    per_url = max(options['duplicates'], 1)
+    return [{
+        'url': f'{base_url}/binary/{options["binary_size"]}/{i // per_url}.bin',
+        'filename': f'duplicates/{i}.bin'
+    } for i in range(options['rows'])]
+
+
+def resize_rows(name):
+    def rows(base_url, options):
+        width, height = options['image_size']
+        return [{
+            'url': f'{base_url}/image/{width}x{height}/{i}.jpg',
+            'filename': f'{name}/{i}.jpg',
+            **RESIZE_SCENARIOS[name]
+        } for i in range(options['rows'])]
+
+    return rows
+
+
+SCENARIOS = {
+    'claim': claim_rows,
+    'download': download_rows,
+    **{name: resize_rows(name) for name in RESIZE_SCENARIOS},
+    'duplicates': duplicate_rows
+}
+
+
+def percentile(values, percent):
+    """Nearest rank percentile, None without values.
+    """
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    return ordered[max(math.ceil(len(ordered) * percent / 100) - 1, 0)]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process or the largest of its finished worker processes, None where unsupported.
+    """
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)  # Bytes on macOS, kilobytes elsewhere.
+
+
+def write_config(directory, name, options):
+    """Write the config.ini of a scenario. Every row is timed, timings give the latency percentiles.
+
+    Returns:
+        str: Path of config.ini.
+    """
+    parser = configparser.ConfigParser()
+    parser['database'] = {
+        'url': options['database_url'] or 'sqlite:///benchmark.db',
+        'table_prefix': f'rowdo_benchmark_{name}'
+    }
+    parser['runtime'] = {
+        'batch_size': str(options['batch_size']),
+        'cursor_lag_seconds': '0',
+        'workers': str(options['workers']),
+        'worker_type': options['worker_type'],
+        'engine': options['engine'],
+        'async_concurrency': str(options['async_concurrency'])
+    }
+    parser['download'] = {'path': 'files'}
+    parser['image'] = {'processes': str(options['image_processes'])}
+    parser['timings'] = {'sample_percent': str(options['sample_percent'])}
+
+    path = os.path.join(directory, 'config.ini')
+    with open(path, 'w', encoding='utf-8') as config_file:
+        parser.write(config_file)
+
+    return path
+
+
+def reset_tables(db):
+    """Empty the tables of a scenario, for databases kept between runs.
+    """
+    session = db.session()
+    for name in ('file_timings', 'file_variants', 'error_logs', 'files'):
+        session.query(db.get_table(name)).delete(synchronize_session=False)
+    session.commit()
+
+    db.set_runtime({'last_checked_timestamp': None, 'last_checked_id': None})
+    db.flush_writes()
+
+
+def seed_rows(db, rows):
+    """Insert rows as if they were written a second ago, so the first routine's cursor reaches them.
+    """
+    seeded_at = db.database_now().replace(microsecond=0) - timedelta(seconds=1)
+    session = db.session()
+    session.execute(db.get_table('files').__table__.insert(), [{**row, 'created_at': seeded_at, 'updated_at': seeded_at} for row in rows])
+    session.commit()
+    db.close_session()
+
+
+def create_watcher(db, engine):
+    if engine == 'async':
+        import rowdo.aio
+        return rowdo.aio.AsyncWatcher(db)
+
+    import rowdo.watcher
+    return rowdo.watcher.Watcher(db)
+
+
+def drain(watcher, db):
+    """Run routines until no row is waiting or being processed.
+
+    Returns:
+        int: Routines run.
+    """
+    for passes in range(1, MAX_PASSES + 1):
+        watcher.routine()
+        if not has_pending_rows(db):
+            break
+
+    return passes
+
+
+async def drain_async(watcher, db):
+    async with watcher.running():
+        for passes in range(1, MAX_PASSES + 1):
+            await watcher.routine_async()
+            if not await watcher.run_blocking(has_pending_rows, db):
+                break
+
+    return passes
+
+
+def has_pending_rows(db):
+    counts, _ = db.get_queue_stats()
+    return bool(counts.get(rowdo.database.STATUS_WAITING_TO_PROCESS) or counts.get(rowdo.database.STATUS_PROCESSING))
+
+
+def read_results(db):
+    """
+    Returns:
+        tuple: Row counts by status name, total_ms of each timed row and mean milliseconds of each stage.
+    """
+    counts, _ = db.get_queue_stats()
+    session = db.session()
+    timings = session.query(db.get_table('file_timings')).all()
+    session.commit()
+
+    stages = {}
+    for stage in rowdo.timing.STAGES:
+        values = [value for value in (getattr(timing, f'{stage}_ms') for timing in timings) if value is not None]
+        if values:
+            stages[stage] = round(sum(values) / len(values), 3)
+
+    statuses = {rowdo.database.STATUS_NAMES[status]: count for status, count in counts.items()}
+    return statuses, [timing.total_ms for timing in timings], stages
+
+
+def run_scenario(name, base_url, options):
+    """Seed the rows of a scenario into a fresh database, process them all and measure it.
+    Runs in its own process, started by run_benchmark, so peak RSS and global state belong to the scenario alone.
+
+    Args:
+        base_url (str): URL of the SyntheticServer.
+        options (dict): Options of rowdo.benchmark.__main__.
+
+    Returns:
+        dict: Measurements of the scenario.
+    """
+    logger.remove()
+    logger.add(sys.stderr, level=options['log_level'])
+    warnings.filterwarnings('ignore', message='Dialect sqlite.*Decimal', category=SAWarning)
+
+    directory = os.path.join(options['directory'], name)
+    os.makedirs(directory, exist_ok=True)
+    os.chdir(directory)
+    config.CONFIG_PATH = write_config(directory, name, options)
+    config.load(config.CONFIG_PATH)
+    if config.get('database', 'url').startswith('sqlite'):
+        rowdo.benchmark.sqlite.install()
+
+    db = rowdo.database.Database()
+    reset_tables(db)
+    rows = SCENARIOS[name](base_url, options)
+    seed_rows(db, rows)
+
+    watcher = create_watcher(db, options['engine'])
+    started = perf_counter()
+    try:
+        if options['engine'] == 'async':
+            passes = asyncio.run(drain_async(watcher, db))
+        else:
+            passes = drain(watcher, db)
+        seconds = perf_counter() - started
+    finally:
+        watcher.shutdown_workers()
+
+    db.flush_writes()
+    statuses, latencies, stages = read_results(db)
+    db.close_session()
+    peak_rss = peak_rss_mb()
+
+    return {
+        'scenario': name,
+        'rows': len(rows),
+        'passes': passes,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(len(rows) / seconds, 1) if seconds else None,
+        'p50_ms': percentile(latencies, 50),
+        'p99_ms': percentile(latencies, 99),
+        'peak_rss_mb': round(peak_rss, 1) if peak_rss is not None else None,
+        'statuses': statuses,
+        'stages_ms': stages
+    }
+
+
+def run_benchmark(scenarios, options, report=print):
+    """Serve synthetic files locally and run each scenario in a new process.
+
+    Args:
+        scenarios (list): Names in SCENARIOS.
+        options (dict): Options of rowdo.benchmark.__main__.
+        report (callable): Called with each finished result.
+
+    Returns:
+        list: Results of run_scenario, with the number of HTTP requests each scenario made.
+    """
+    server = SyntheticServer(latency=options['latency_ms'] / 1000).start()
+    results = []
+    try:
+        for name in scenarios:
+            requests_before = sum(server.hits.values())
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                result = executor.submit(run_scenario, name, server.base_url, options).result()
+            result['requests'] = sum(server.hits.values()) - requests_before
+            report(result)
+            results.append(result)
+    finally:
+        server.stop()
+
+    return results
+
+
+def format_table(results, baseline=None):
+    """Results as a text table, with the change of rows per second and p99 against baseline results.
+    """
+    baseline = {result['scenario']: result for result in baseline or []}
+    columns = ['scenario', 'rows', 'seconds', 'rows/s', 'p50 ms', 'p99 ms', 'peak RSS MB', 'requests', 'not done']
+    if baseline:
+        columns += ['rows/s change', 'p99 change']
+
+    lines = []
+    for result in results:
+        not_done = sum(count for status, count in result['statuses'].items() if status != 'done')
+        line = [result['scenario'], result['rows'], result['seconds'], result['rows_per_second'], result['p50_ms'],
+                result['p99_ms'], result['peak_rss_mb'], result.get('requests'), not_done]
+        if baseline:
+            previous = baseline.get(result['scenario'], {})
+            line += [change(previous.get('rows_per_second'), result['rows_per_second']), change(previous.get('p99_ms'), result['p99_ms'])]
+        lines.append(['-' if value is None else str(value) for value in line])
+
+    widths = [max(len(column), *(len(line[index]) for line in lines)) for index, column in enumerate(columns)]
+    rendered = [columns, ['-' * width for width in widths]] + lines
+    return '\n'.join('  '.join(value.ljust(width) for value, width in zip(line, widths)).rstrip() for line in rendered)
+
+
+def change(previous, current):
+    if not previous or current is None:
+        return None
+
+    return f'{(current - previous) / previous * 100:+.1f}%'
+
+
+def regressions(results, baseline, max_percent):
+    """
+    Returns:
+        list: Scenarios whose rows per second fell more than max_percent below baseline.
+    """
+    previous = {result['scenario']: result.get('rows_per_second') for result in baseline}
+    regressed = []
+    for result in results:
+        floor = (previous.get(result['scenario']) or 0) * (1 - max_percent / 100)
+        if result['rows_per_second'] is not None and result['rows_per_second'] < floor:
+            regressed.append(result['scenario'])
+
+    return regressed
+
+
+def load_results(path):
+    with open(path, 'r', encoding='utf-8') as results_file:
+        return json.load(results_file)
+
+
+def save_results(path, results):
+    with open(path, 'w', encoding='utf-8') as results_file:
+        json.dump(results, results_file, indent=2)
@@ -0,0 +1,78 @@
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+
+from rowdo.benchmark import SCENARIOS, run_benchmark, format_table, regressions, load_results, save_results
+
+
+def image_size(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m rowdo.benchmark',
+        description='Benchmark rowdo against a local HTTP server and a SQLite database, seeded with synthetic rows.'
+    )
+    parser.add_argument('scenarios', nargs='*', metavar='scenario', help=f'Scenarios to run, all by default: {", ".join(SCENARIOS)}.')
+    parser.add_argument('--rows', type=int, default=500, help='Rows seeded per scenario. Default: 500')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='Delay of the HTTP server before every response. Default: 5')
+    parser.add_argument('--binary-size', type=int, default=256 * 1024, help='Bytes of downloaded binaries. Default: 262144')
+    parser.add_argument('--image-size', type=image_size, default=(1024, 768), help='WIDTHxHEIGHT of served images. Default: 1024x768')
+    parser.add_argument('--duplicates', type=int, default=10, help='Rows per URL in the duplicates scenario. Default: 10')
+    parser.add_argument('--engine', choices=['sync', 'async'], default='sync', help='Default: sync')
+    parser.add_argument('--workers', type=int, default=4, help='Default: 4')
+    parser.add_argument('--worker-type', choices=['thread', 'process'], default='thread', help='Default: thread')
+    parser.add_argument('--async-concurrency', type=int, default=100, help='Default: 100')
+    parser.add_argument('--image-processes', type=int, default=0, help='Default: 0')
+    parser.add_argument('--batch-size', type=int, default=100, help='Default: 100')
+    parser.add_argument('--sample-percent', type=float, default=100.0,
+                        help='Rows timed in file_timings, latency percentiles are taken from them. Default: 100')
+    parser.add_argument('--database-url', default=None,
+                        help='SQLAlchemy URL of a database to use instead of SQLite, its benchmark tables are emptied first.')
+    parser.add_argument('--directory', default=None, help='Working directory of the scenarios, kept. Default: a temporary one, removed.')
+    parser.add_argument('--json', default=None, help='Write results to this file.')
+    parser.add_argument('--compare', default=None, help='Results file of an earlier run to compare with.')
+    parser.add_argument('--max-regression', type=float, default=None,
+                        help='Exit with 1 if rows/s of a scenario is more than this percent below --compare.')
+    parser.add_argument('--log-level', default='ERROR', help='Log level of rowdo in scenarios. Default: ERROR')
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f'Unknown scenarios: {", ".join(unknown)}')
+
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = args.scenarios or list(SCENARIOS)
+    baseline = load_results(args.compare) if args.compare else None
+
+    options = vars(args)
+    temporary = not args.directory
+    options['directory'] = os.path.abspath(args.directory or tempfile.mkdtemp(prefix='rowdo-benchmark-'))
+    try:
+        results = run_benchmark(scenarios, options, report=lambda result: print(f'{result["scenario"]} done in {result["seconds"]} s', file=sys.stderr))
+    finally:
+        if temporary:
+            shutil.rmtree(options['directory'], ignore_errors=True)
+
+    print(format_table(results, baseline))
+    if args.json:
+        save_results(args.json, results)
+
+    if baseline and args.max_regression is not None:
+        regressed = regressions(results, baseline, args.max_regression)
+        if regressed:
+            print(f'Regressed more than {args.max_regression}%: {", ".join(regressed)}', file=sys.stderr)
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+import io
+import threading
+from time import sleep
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from PIL import Image
+
+
+class SyntheticHandler(BaseHTTPRequestHandler):
+    """Serves `/image/<width>x<height>/<name>.jpg` and `/binary/<bytes>/<name>.bin`.
+    Names only make URLs distinct, every body of a size is the same.
+    """
+    protocol_version = 'HTTP/1.1'  # Keep alive, as real file hosts do.
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def respond(self, send_body):
+        try:
+            content_type, body = self.server.body(self.path.split('?', 1)[0])
+        except (ValueError, IndexError):
+            self.send_error(404)
+            return
+
+        self.server.count(self.path)
+        if self.server.latency:
+            sleep(self.server.latency)
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SyntheticServer(ThreadingHTTPServer):
+    """Local HTTP server standing in for file hosts in benchmarks, with a fixed latency before every response.
+    Bodies are generated on first request and kept for the next ones.
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        super().__init__((host, port), SyntheticHandler)
+        self.latency = latency
+        self.hits = {}
+        self._bodies = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f'http://{self.server_address[0]}:{self.server_port}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='rowdo-benchmark-http', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, path):
+        with self._lock:
+            self.hits[path] = self.hits.get(path, 0) + 1
+
+    def body(self, path):
+        """
+        Returns:
+            tuple: Content type and body of a path. Raises ValueError or IndexError for unknown paths.
+        """
+        _, kind, size, _ = path.split('/', 3)
+        key = (kind, size)
+        with self._lock:
+            if key not in self._bodies:
+                if kind == 'image':
+                    self._bodies[key] = ('image/jpeg', self.render_image(*map(int, size.split('x'))))
+                elif kind == 'binary':
+                    self._bodies[key] = ('application/octet-stream', bytes(range(256)) * (int(size) // 256) + bytes(int(size) % 256))
+                else:
+                    raise ValueError(f'Unknown body kind: {kind}')
+
+            return self._bodies[key]
+
+    @staticmethod
+    def render_image(width, height):
+        """JPEG with noise and gradients, so it costs about as much to decode and encode as a photo.
+        """
+        size = (width, height)
+        bands = [Image.effect_noise(size, 48), Image.linear_gradient('L').resize(size), Image.radial_gradient('L').resize(size)]
+        buffer = io.BytesIO()
+        Image.merge('RGB', bands).save(buffer, 'JPEG', quality=90)
+        return buffer.getvalue()
@@ -0,0 +1,36 @@
+from sqlalchemy import DateTime
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.dialects.sqlite import pysqlite
+
+
+SECONDS_FORMAT = '%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d'
+
+_installed = False
+
+
+def _create_column(element, compiler, **kw):
+    # SQLite has no ON UPDATE clause, updated_at is still set by the ORM's onupdate.
+    return compiler.visit_create_column(element, **kw).replace(' ON UPDATE CURRENT_TIMESTAMP', '')
+
+
+class SecondsDateTime(pysqlite.SQLiteDialect_pysqlite.colspecs[DateTime]):
+    """DateTime stored in whole seconds as CURRENT_TIMESTAMP does, so timestamps of both compare as text.
+    """
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('storage_format', SECONDS_FORMAT)
+        super().__init__(*args, **kwargs)
+
+
+def install():
+    """Make SQLite stand in for MySQL in benchmarks: drop the MySQL only ON UPDATE defaults from created tables,
+    and keep timestamps written by SQLAlchemy in the format of the ones written by SQLite.
+    Applies to every SQLite engine of the process, rowdo itself is run on MySQL.
+    """
+    global _installed
+    if _installed:
+        return
+
+    compiles(CreateColumn, 'sqlite')(_create_column)
+    pysqlite.SQLiteDialect_pysqlite.colspecs[DateTime] = SecondsDateTime
+    _installed = True
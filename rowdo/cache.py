@@ -0,0 +1,220 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from time import time
+
+from rowdo.logging import logger
+
+
+KEPT_HEADERS = ('content-type', 'content-disposition')  # Response headers read again when a stored body is served.
+
+
+def link_or_copy(source, target, hardlink=True):
+    if hardlink:
+        try:
+            os.link(source, target)
+            return
+        except OSError:  # Different filesystem or no hardlink support.
+            pass
+
+    shutil.copyfile(source, target)
+
+
+class DownloadCache:
+    """Content addressed store of downloaded files on local disk.
+
+    Bodies are stored once per sha256 digest in `objects/`, so different URLs serving the same bytes share one copy.
+    Each URL has an entry in `urls/` with its digest, response headers and ETag / Last-Modified validators,
+    used to serve duplicates from disk and to send conditional requests when the URL is downloaded again.
+    Bodies are evicted least recently used first once the store grows over max_bytes.
+
+    Files are shared with hardlinks when hardlink is set, so a cached body and the files saved from it take the space once.
+    """
+    def __init__(self, path, max_bytes, fresh_seconds=0, hardlink=True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.fresh_seconds = fresh_seconds
+        self.hardlink = hardlink
+
+        self._objects_path = os.path.join(path, 'objects')
+        self._urls_path = os.path.join(path, 'urls')
+        os.makedirs(self._objects_path, exist_ok=True)
+        os.makedirs(self._urls_path, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._size = None  # Bytes stored, scanned on first store.
+
+    @staticmethod
+    def _sharded(root, digest, extension=''):
+        return os.path.join(root, digest[:2], f'{digest}{extension}')
+
+    def _entry_path(self, url):
+        return self._sharded(self._urls_path, hashlib.sha256(url.encode('utf-8')).hexdigest(), '.json')
+
+    def _object_path(self, digest):
+        return self._sharded(self._objects_path, digest)
+
+    def lookup(self, url):
+        """
+        Returns:
+            dict: Cache entry of the URL, None if URL or its body is not cached.
+        """
+        entry_path = self._entry_path(url)
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+
+        if entry.get('url') != url:
+            return None
+
+        if not os.path.exists(self._object_path(entry['digest'])):  # Evicted.
+            self.remove_file(entry_path)
+            return None
+
+        return entry
+
+    def is_fresh(self, entry):
+        """Entry was fetched less than fresh_seconds ago and can be served without asking the server.
+        """
+        return bool(self.fresh_seconds) and time() - entry['fetched_at'] < self.fresh_seconds
+
+    @staticmethod
+    def conditional_headers(entry):
+        """If-None-Match and If-Modified-Since headers revalidating an entry.
+        """
+        headers = {}
+        if not entry:
+            return headers
+
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        return headers
+
+    def store(self, url, temp_path, digest, headers):
+        """Add a downloaded body and point the URL to it.
+        If the same bytes are already stored, temp_path is replaced with a link to the stored copy.
+        """
+        object_path = self._object_path(digest)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        with self._lock:
+            if not os.path.exists(object_path):
+                link_or_copy(temp_path, object_path, self.hardlink)
+                self._grow(os.path.getsize(object_path))
+            else:
+                if self.hardlink:
+                    self._share(object_path, temp_path)
+                self._touch(object_path)
+
+        self._write_entry(url, {
+            'url': url,
+            'digest': digest,
+            'etag': headers.get('etag'),
+            'last_modified': headers.get('last-modified'),
+            'headers': {name: headers[name] for name in KEPT_HEADERS if headers.get(name)},
+            'fetched_at': time()
+        })
+
+    def revalidated(self, url, entry, headers):
+        """Server answered 304 Not Modified, keep the entry fresh with any updated validators.
+        """
+        entry = {
+            **entry,
+            'etag': headers.get('etag') or entry.get('etag'),
+            'last_modified': headers.get('last-modified') or entry.get('last_modified'),
+            'fetched_at': time()
+        }
+        self._write_entry(url, entry)
+        return entry
+
+    def materialize(self, entry, target_path):
+        """Create target_path with the cached body of an entry.
+        """
+        object_path = self._object_path(entry['digest'])
+        link_or_copy(object_path, target_path, self.hardlink)
+        self._touch(object_path)
+
+    def _write_entry(self, url, entry):
+        entry_path = self._entry_path(url)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        temp_entry_path = f'{entry_path}.{os.getpid()}.{threading.get_ident()}.part'
+        with open(temp_entry_path, 'w', encoding='utf-8') as entry_file:
+            json.dump(entry, entry_file)
+        os.replace(temp_entry_path, entry_path)
+
+    @staticmethod
+    def _share(object_path, temp_path):
+        """Replace a duplicate download with a link to the stored copy, so the saved file does not take space twice.
+        """
+        linked_path = f'{temp_path}.link'
+        try:
+            os.link(object_path, linked_path)
+            os.replace(linked_path, temp_path)
+        except OSError:  # Different filesystem, keep the downloaded copy.
+            DownloadCache.remove_file(linked_path)
+
+    @staticmethod
+    def _touch(path):
+        """Mark a body as used now. Only access time changes, files linked to it keep their modification time.
+        """
+        try:
+            stat = os.stat(path)
+            os.utime(path, (time(), stat.st_mtime))
+        except OSError:
+            pass
+
+    @staticmethod
+    def remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _scan(self):
+        """
+        Returns:
+            list: (last used, size, path) of every stored body.
+        """
+        objects = []
+        for directory, _, filenames in os.walk(self._objects_path):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                objects.append((stat.st_atime, stat.st_size, path))
+
+        return objects
+
+    def _grow(self, added):
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._scan())
+        else:
+            self._size += added
+
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        """Remove least recently used bodies until the store is under 90% of max_bytes.
+        Their URL entries are dropped on their next lookup.
+        """
+        objects = sorted(self._scan())
+        self._size = sum(size for _, size, _ in objects)
+        low_water = self.max_bytes * 0.9
+        evicted = 0
+        for _, size, path in objects:
+            if self._size <= low_water:
+                break
+            self.remove_file(path)
+            self._size -= size
+            evicted += 1
+
+        logger.debug(f'Download cache evicted {evicted} files, {self._size} bytes left.')
@@ -1,5 +1,8 @@
 import configparser
 import os
+import signal
+import threading
+from types import MappingProxyType
 
 
 class NoValue:
@@ -16,11 +19,22 @@ DEFAULTS = {
     "runtime": {
         "debug": False,
         "run_every_seconds": 10,
-        "working_directory": False
+        "working_directory": False,
+        "batch_size": 500,
+        "cursor_lag_seconds": 1.0,
+        "priority_aging_seconds": 60.0,
+        "workers": 1,
+        "worker_type": "thread",
+        "node_id": False,
+        "lease_seconds": 600,
+        "engine": "sync",
+        "async_concurrency": 100
     },
     "database": {
         "table_prefix": "rowdo",
-        "url": False
+        "url": False,
+        "write_batch_size": 100,
+        "write_flush_seconds": 1.0
     },
     "download": {
         "disallow_from": "",
@@ -30,14 +44,93 @@ DEFAULTS = {
         "path": os.path.join('files'),
         "keep_relative_path": True,
         "allow_mime_types": "*",
-        "max_attempts": 3
+        "max_attempts": 3,
+        "attempt_delay_seconds": 30.0,
+        "max_attempt_delay_seconds": 3600.0,
+        "attempt_delay_jitter": 0.2,
+        "chunk_size": 65536,
+        "head_check": False,
+        "keep_alive": True,
+        "pool_connections": 10,
+        "pool_maxsize": 10,
+        "pool_block": False,
+        "connect_timeout": 10.0,
+        "read_timeout": 60.0,
+        "retries": 2,
+        "retry_backoff": 0.5,
+        "retry_statuses": "500, 502, 504",
+        "resume_min_bytes": 1048576
+    },
+    "image": {
+        "resize_filter": "bicubic",
+        "reducing_gap": 3.0,
+        "draft": True,
+        "quality": 0,
+        "optimize": False,
+        "progressive": False,
+        "processes": 0
+    },
+    "cache": {
+        "enabled": False,
+        "path": os.path.join('cache'),
+        "max_size_mb": 1024,
+        "fresh_seconds": 0.0,
+        "hardlink": True
+    },
+    "metrics": {
+        "enabled": False,
+        "host": "127.0.0.1",
+        "port": 9464,
+        "queue_seconds": 60
+    },
+    "timings": {
+        "sample_percent": 0.0
+    },
+    "hosts": {
+        "limits": "",
+        "rate_per_second": 0.0,
+        "burst": 1.0,
+        "concurrency": 0,
+        "backoff_seconds": 30.0,
+        "max_backoff_seconds": 600.0,
+        "max_wait_seconds": 10.0
+    }
+}
+
+
+# Types of settings whose defaults do not hint them. Others are coerced to the type of their default.
+TYPES = {
+    "runtime": {
+        "working_directory": str,
+        "node_id": str
+    },
+    "database": {
+        "url": str
+    },
+    "download": {
+        "disallow_from": list,
+        "allow_from": list,
+        "allow_formats_url": list,
+        "allow_mime_types": list,
+        "retry_statuses": list
+    },
+    "hosts": {
+        "limits": list
     }
 }
 
+CONFIG_PATH = './config.ini'
 
-def deep_get(levels):
+_SNAPSHOT = MappingProxyType({})
+_SNAPSHOT_MTIME = None
+_LOADED = False
+_LOCK = threading.Lock()
+_RELOAD_REQUESTED = False  # Set by SIGHUP, handled by the next refresh.
+
+
+def deep_get(levels, source=DEFAULTS):
     no_val = NoValue()
-    out = DEFAULTS
+    out = source
 
     for level in levels:
         if out is not no_val:
@@ -48,9 +141,122 @@ def deep_get(levels):
     return out
 
 
+def coerce(section, option, value):
+    """Convert a raw config.ini string or a default to the type of the setting.
+    """
+    value_type = TYPES.get(section, {}).get(option)
+    if not value_type:
+        default = deep_get((section, option))
+        value_type = type(default) if not isinstance(default, NoValue) else str
+
+    if value_type == list:
+        return to_list(value)
+
+    if not isinstance(value, str) or value_type == str:
+        return value
+
+    if value_type == bool:
+        if value.lower() not in CONFIG.BOOLEAN_STATES:
+            raise ValueError(f'Not a boolean: {value}')
+        return CONFIG.BOOLEAN_STATES[value.lower()]
+
+    return value_type(value)
+
+
+def to_list(value):
+    if isinstance(value, (list, tuple)):
+        return list(value)
+
+    return [item.strip() for item in value.split(',')]
+
+
+def load(path=None):
+    """Parse config.ini into a new immutable snapshot of typed values.
+    """
+    global CONFIG, _SNAPSHOT, _SNAPSHOT_MTIME, _LOADED
+    path = path or CONFIG_PATH
+    with _LOCK:
+        parser = configparser.ConfigParser()
+        parser.read(path)
+
+        snapshot = {}
+        for section in parser.sections():
+            values = {}
+            for option, raw in parser.items(section):
+                try:
+                    values[option] = coerce(section, option, raw)
+                except ValueError as err:
+                    import rowdo.logging
+                    err = ValueError(f'Invalid setting in {path}: {section} -> {option} = {raw}. {err}')
+                    rowdo.logging.logger.error(err)
+                    raise err
+            snapshot[section] = MappingProxyType(values)
+
+        try:
+            _SNAPSHOT_MTIME = os.stat(path).st_mtime
+        except OSError:
+            _SNAPSHOT_MTIME = None
+
+        CONFIG = parser
+        _SNAPSHOT = MappingProxyType(snapshot)
+        _LOADED = True
+
+    return _SNAPSHOT
+
+
+def reload():
+    load()
+    import rowdo.logging
+    rowdo.logging.logger.info('Configuration reloaded.')
+
+
+def refresh():
+    """Reload config.ini if it was modified since it was loaded, or a reload was requested.
+
+    Returns:
+        bool: True if configuration was reloaded.
+    """
+    global _RELOAD_REQUESTED
+    try:
+        mtime = os.stat(CONFIG_PATH).st_mtime
+    except OSError:
+        mtime = None
+
+    requested, _RELOAD_REQUESTED = _RELOAD_REQUESTED, False
+    if not requested and mtime == _SNAPSHOT_MTIME:
+        return False
+
+    reload()
+    return True
+
+
+def request_reload(signum=None, frame=None):
+    """Make the next refresh reload configuration. Safe to call from a signal handler, nothing is read here.
+    """
+    global _RELOAD_REQUESTED
+    _RELOAD_REQUESTED = True
+
+
+def install_reload_signal():
+    """Reload configuration on SIGHUP where available, at the watcher's next refresh.
+    """
+    if hasattr(signal, 'SIGHUP') and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGHUP, request_reload)
+
+
+def snapshot():
+    if not _LOADED:
+        load()
+
+    return _SNAPSHOT
+
+
 def get(*args, default=BlankDefault(), return_type=None):
-    CONFIG.read('./config.ini')
-    value = CONFIG.get(*args, fallback=deep_get(args))
+    value = deep_get(args, snapshot())
+    if isinstance(value, NoValue):
+        value = deep_get(args)
+        if not isinstance(value, NoValue):
+            value = coerce(*args, value)
 
     found = None
     if isinstance(value, NoValue):
@@ -65,9 +271,6 @@ def get(*args, default=BlankDefault(), return_type=None):
         found = value
 
     if return_type == list:
-        found_whitespaced_list = found.split(',')
-        found = []
-        for item in found_whitespaced_list:
-            found.append(item.strip())
+        found = to_list(found)
 
     return found
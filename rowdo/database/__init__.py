@@ -1,10 +1,18 @@
-from datetime import datetime
+import os
+import socket
+from uuid import uuid4
+from types import SimpleNamespace
+from datetime import datetime, timedelta
 
-from sqlalchemy import create_engine, asc
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import create_engine, asc, select, or_, and_, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base
 
 from rowdo.database.base import RowdoBase
+from rowdo.database.writer import WriteBehind
+import rowdo.database.migrations
 from rowdo.logging import logger
+from rowdo.metrics import timed_operation
 import rowdo.config as config
 import rowdo.exceptions
 from rowdo.version import __schema_version__
@@ -24,6 +32,23 @@ STATUS_ERROR = 3
 STATUS_WILL_RETRY = 4
 STATUS_MAX_RETRIES_REACHED = 5
 
+COMMAND_NAMES = {
+    COMMAND_IDLE: 'idle',
+    COMMAND_DOWNLOAD: 'download',
+    COMMAND_DELETE: 'delete',
+    COMMAND_DELETE_FILE_ONLY: 'delete_file_only',
+    COMMAND_DELETE_ROW_ONLY: 'delete_row_only'
+}
+
+STATUS_NAMES = {
+    STATUS_WAITING_TO_PROCESS: 'waiting_to_process',
+    STATUS_PROCESSING: 'processing',
+    STATUS_DONE: 'done',
+    STATUS_ERROR: 'error',
+    STATUS_WILL_RETRY: 'will_retry',
+    STATUS_MAX_RETRIES_REACHED: 'max_retries_reached'
+}
+
 RESIZE_NONE = -1
 RESIZE_PASSTHROUGH = 0
 RESIZE_DIMENSIONS = 1
@@ -31,8 +56,16 @@ RESIZE_RATIO = 2
 
 
 class Database:
-    def __init__(self):
+    def __init__(self, cleanup=True, node_id=None):
+        """SQLAlchemy backed database access for rowdo.
+
+        Args:
+            cleanup (bool, optional): Recover stale claims on start. Worker processes should pass False. Defaults to True.
+            node_id (str, optional): Claim owner id. Defaults to config.runtime.node_id or a generated id.
+        """
         self._prefix = config.get('database', 'table_prefix')
+        self.node_id = node_id or config.get('runtime', 'node_id') or f'{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}'
+        self.lease_seconds = config.get('runtime', 'lease_seconds')
         connect_url = config.get('database', 'url')
         if not connect_url:
             host = config.get('database', 'host')
@@ -41,9 +74,17 @@ class Database:
             database = config.get('database', 'database')
 
             connect_url = f"mysql://{user}:{password}@{host}/{database}"
-        self._engine = create_engine(connect_url, echo=False, future=True, encoding='utf-8')
+
+        engine_options = {}
+        workers = config.get('runtime', 'workers')
+        if workers > 5 and not connect_url.startswith('sqlite'):
+            # Every worker thread holds its own connection.
+            engine_options['pool_size'] = workers
+
+        self._engine = create_engine(connect_url, echo=False, future=True, encoding='utf-8', **engine_options)
 
         self._session_maker = sessionmaker(bind=self._engine)
+        self._scoped_session = scoped_session(self._session_maker)  # One session per worker thread.
         self._declarative_base = declarative_base(cls=RowdoBase)
 
         self.tables = {}
@@ -52,103 +93,466 @@ class Database:
             name = module.TABLE_NAME
             self.tables[name] = orm_class
 
+        new_schema = rowdo.database.migrations.is_new_schema(self._engine, self.tables)
         self._declarative_base.metadata.create_all(self._engine)
-        self._session = None
 
-        self._cleanup_processing_rows()
+        self.writer = WriteBehind(
+            self._session_maker,
+            self.tables,
+            batch_size=config.get('database', 'write_batch_size'),
+            flush_seconds=config.get('database', 'write_flush_seconds')
+        )
+
+        self._presets = {}
+        self.presets_version = None
+
+        self._clock_offset = self._read_clock_offset()
+        self._skip_locked = self._supports_skip_locked()
+
+        if cleanup:
+            previous_version = rowdo.database.migrations.migrate(self._engine, self.tables, new_schema=new_schema)
+            self._create_runtime(previous_version)
+            self.recover_stale_claims(include_own=True)
 
     def get_table(self, name):
         return self.tables[name]
 
     def session(self):
-        if not self._session:
+        if not self._scoped_session.registry.has():
             self.begin_session()
 
-        return self._session
+        return self._scoped_session()
 
     def begin_session(self):
         logger.debug('SQLAlchemy New Session')
-        self._session = self._session_maker()
-        self._session.commit()
+        self._scoped_session().commit()
 
     def close_session(self):
         logger.debug('SQLAlchemy Close Session')
-        if self._session:
-            self._session.close()
-            self._session = None
+        if self._scoped_session.registry.has():
+            self._scoped_session.remove()
+
+    def _read_clock_offset(self):
+        """Difference between the database clock and the local clock.
+        Leases are compared on the database clock so nodes with drifting clocks agree on expiry.
+        """
+        session = self.session()
+        database_now = session.execute(select(func.now())).scalar()
+        self.close_session()
+        return database_now - datetime.now()
+
+    def _supports_skip_locked(self):
+        dialect = self._engine.dialect
+        version = dialect.server_version_info or ()
+        if dialect.name == 'postgresql':
+            return version >= (9, 5)
+        if dialect.name == 'mysql':
+            return version >= ((10, 6) if getattr(dialect, 'is_mariadb', False) else (8, 0, 1))
+
+        return False
+
+    def database_now(self):
+        return datetime.now() + self._clock_offset
 
-    def _update_row(self, orm, fields_and_values: dict):
-        for key, value in fields_and_values.items():
-            setattr(orm, key, value)
+    def lease_expiry(self):
+        return self.database_now() + timedelta(seconds=self.lease_seconds)
 
-    def _cleanup_processing_rows(self):
-        """Reverts the status=STATUS_processing rows back to STATUS_WAITING_TO_PROCESS
-        Call at first run.
+    @staticmethod
+    def _status_list(status):
+        if isinstance(status, int):
+            return [status]
+        elif not isinstance(status, list):
+            raise ValueError('arg. "status" is not correct type.')
+
+        return status
+
+    @timed_operation
+    def recover_stale_claims(self, include_own=False):
+        """Reverts STATUS_PROCESSING rows with an expired lease back to STATUS_WAITING_TO_PROCESS.
+        Rows claimed by other live nodes are left untouched.
+
+        Args:
+            include_own (bool, optional): Also revert rows claimed by this node id, call at first run. Defaults to False.
+
+        Returns:
+            int: Number of recovered rows.
         """
         session = self.session()
         files = self.get_table('files')
-        stuck = session.query(files).filter(files.status == STATUS_PROCESSING)
-        for file_row in stuck:
-            file_row.status = STATUS_WAITING_TO_PROCESS
+        expired = [files.claim_expires_at.is_(None), files.claim_expires_at < self.database_now()]
+        if include_own:
+            expired.append(files.claimed_by == self.node_id)
+
+        recovered = session.query(files).filter(
+            files.status == STATUS_PROCESSING,
+            or_(*expired)
+        ).update({
+            files.status: STATUS_WAITING_TO_PROCESS,
+            files.claimed_by: None,
+            files.claim_expires_at: None
+        }, synchronize_session=False)
         session.commit()
-        self.close_session()
 
-    def read_file_rows(self, status, last_checked_timestamp: datetime = None):
+        if recovered:
+            logger.warning(f'Recovered {recovered} rows with stale claims.')
+
+        return recovered
+
+    def read_file_rows(self, status, last_checked_timestamp: datetime = None, after_id=None, until: datetime = None, limit=None):
+        """Query rows in (updated_at, id) order, keyset paginated after the given cursor.
+
+        Args:
+            status (int|list): Status or statuses to read.
+            last_checked_timestamp (datetime, optional): Read rows updated after this. Defaults to None.
+            after_id (int, optional): With last_checked_timestamp, also read rows updated at it with a bigger id. Defaults to None.
+            until (datetime, optional): Read rows updated before this. Defaults to None.
+            limit (int, optional): Page size, unlimited queries are streamed in chunks of config.runtime.batch_size. Defaults to None.
+
+        Returns:
+            sqlalchemy.orm.Query: Rows
+        """
         session = self.session()
         files = self.get_table('files')
         arguments = []
-        if isinstance(status, int):
-            status = [status]
-        elif not isinstance(status, list):
-            raise ValueError('arg. "status" is not correct type.')
+        status = self._status_list(status)
 
-        if last_checked_timestamp:
+        if last_checked_timestamp and after_id is not None:
+            arguments.append(or_(
+                files.updated_at > last_checked_timestamp,
+                and_(files.updated_at == last_checked_timestamp, files.id > after_id)
+            ))
+        elif last_checked_timestamp:
             arguments.append(files.updated_at > last_checked_timestamp)
 
-        query = session.query(files).filter(*arguments, files.status.in_(status)).order_by(asc(files.updated_at))
+        if until:
+            arguments.append(files.updated_at < until)
+
+        query = session.query(files).filter(*arguments, files.status.in_(status)).order_by(asc(files.updated_at), asc(files.id))
+
+        if limit:
+            return query.limit(limit)
+
+        return query.yield_per(config.get('runtime', 'batch_size'))
+
+    def read_priority_rows(self, status, until: datetime = None, limit=None):
+        """Query rows above the default priority, oldest first within each priority.
+        Every priority is read with its own range scan of the (status, priority, updated_at, id) index,
+        so the rows at the default priority are never scanned.
+
+        Returns:
+            list: (id, updated_at, priority) rows of each priority, highest priority first.
+        """
+        session = self.session()
+        files = self.get_table('files')
+        status = self._status_list(status)
+
+        levels = session.query(files.priority).filter(files.status.in_(status), files.priority > 0).distinct().all()
+        lanes = []
+        for (level,) in sorted(levels, reverse=True):
+            query = session.query(files.id, files.updated_at, files.priority).filter(files.status.in_(status), files.priority == level)
+            if until:
+                query = query.filter(files.updated_at < until)
+            lanes.append(query.order_by(asc(files.updated_at), asc(files.id)).limit(limit).all())
+
+        return lanes
+
+    def read_due_rows(self, status, limit=None):
+        """Query rows whose next_attempt_at has passed, or was never set, in the order they became due.
+
+        Returns:
+            list: (id, updated_at, priority) rows.
+        """
+        session = self.session()
+        files = self.get_table('files')
+        status = self._status_list(status)
+
+        query = session.query(files.id, files.updated_at, files.priority).filter(
+            files.status.in_(status),
+            or_(files.next_attempt_at.is_(None), files.next_attempt_at <= self.database_now())
+        ).order_by(asc(files.next_attempt_at), asc(files.id)).limit(limit)
+
+        return query.all()
+
+    def _merge_lanes(self, lanes, limit, aging_seconds=0):
+        """Take up to limit rows from the fronts of lanes ordered oldest first.
+        Front with the highest priority goes first, a row gains one priority for every aging_seconds it waited.
+
+        Returns:
+            tuple: Taken ids in order, number of rows passed in the first lane.
+        """
+        now = self.database_now()
+
+        def rank(row):
+            waited = (now - row.updated_at).total_seconds() / aging_seconds if aging_seconds else 0
+            return -((row.priority or 0) + waited), row.updated_at, row.id
+
+        fronts = [0] * len(lanes)
+        taken = {}
+        while len(taken) < limit:
+            best = None
+            for index, lane in enumerate(lanes):
+                while fronts[index] < len(lane) and lane[fronts[index]].id in taken:  # Taken from another lane.
+                    fronts[index] += 1
+                if fronts[index] < len(lane) and (best is None or rank(lane[fronts[index]]) < rank(lanes[best][fronts[best]])):
+                    best = index
+
+            if best is None:
+                break
+            taken[lanes[best][fronts[best]].id] = True
+            fronts[best] += 1
 
-        return query
+        return list(taken), fronts[0] if lanes else 0
 
-    def update_file_row(self, file_row, fields_and_values: dict):
+    @timed_operation
+    def claim_file_rows(self, status, last_checked_timestamp: datetime = None, after_id=None, until: datetime = None, limit=None,
+                        priority_until: datetime = None, aging_seconds=0, retry_status=None):
+        """Atomically claim the next page of rows for this node and mark them STATUS_PROCESSING.
+        Candidates are read without locks. Only the rows taken for the page are then locked with
+        SELECT ... FOR UPDATE SKIP LOCKED where the engine supports it, so rows left for a later page are never held
+        by this node where another node would skip them and move the shared cursor past them.
+        The conditional UPDATE keeps the claim exclusive on engines without SKIP LOCKED.
+
+        With priority_until, rows above the default priority updated before it are candidates too, wherever the cursor is.
+        Rows of retry_status are candidates once their next_attempt_at is due, they are not read by the cursor.
+        Page is filled by priority, see _merge_lanes, and the cursor only moves over the rows passed in queue order.
+
+        Returns:
+            tuple: Claimed rows in claim order and (updated_at, id) of the last passed candidate, None if there were no candidates.
+        """
         session = self.session()
-        self._update_row(file_row, fields_and_values)
+        files = self.get_table('files')
+        status = self._status_list(status)
+
+        candidates = self.read_file_rows(status, last_checked_timestamp, after_id, until, limit).with_entities(files.id, files.updated_at, files.priority)
+        lanes = [candidates.all()]
+        if priority_until:
+            lanes.extend(self.read_priority_rows(status, priority_until, limit))
+        if retry_status:
+            lanes.append(self.read_due_rows(retry_status, limit))
+
+        candidate_ids, passed = self._merge_lanes(lanes, limit, aging_seconds)
+        if not candidate_ids:
+            session.commit()
+            return [], None
+
+        cursor = (lanes[0][passed - 1].updated_at, lanes[0][passed - 1].id) if passed else (last_checked_timestamp, after_id)
+        claimable = status + self._status_list(retry_status or [])
+        if self._skip_locked:
+            # Rows locked by another node are being claimed by it, passing them is safe.
+            locked = session.query(files.id).filter(files.id.in_(candidate_ids), files.status.in_(claimable)).with_for_update(skip_locked=True)
+            locked_ids = {row.id for row in locked}
+            candidate_ids = [row_id for row_id in candidate_ids if row_id in locked_ids]
+
+        session.query(files).filter(
+            files.id.in_(candidate_ids),
+            files.status.in_(claimable)
+        ).update({
+            files.status: STATUS_PROCESSING,
+            files.claimed_by: self.node_id,
+            files.claim_expires_at: self.lease_expiry()
+        }, synchronize_session=False)
         session.commit()
 
+        order = {row_id: index for index, row_id in enumerate(candidate_ids)}
+        claimed = session.query(files).filter(
+            files.id.in_(candidate_ids),
+            files.claimed_by == self.node_id,
+            files.status == STATUS_PROCESSING
+        )
+
+        return sorted(claimed, key=lambda row: order[row.id]), cursor
+
+    @timed_operation
+    def get_queue_stats(self):
+        """Row counts by status and the oldest row waiting to process, read from the status index.
+
+        Returns:
+            tuple: Dict of status -> rows, updated_at of the oldest waiting row or None.
+        """
+        session = self.session()
+        files = self.get_table('files')
+        counts = dict(session.query(files.status, func.count(files.id)).group_by(files.status).all())
+        oldest = session.query(func.min(files.updated_at)).filter(files.status == STATUS_WAITING_TO_PROCESS).scalar()
+        session.commit()
+
+        return counts, oldest
+
+    @timed_operation
+    def renew_claim(self, file_row):
+        """Extend the lease of a claimed row.
+        Skips the round trip while more than half of the lease is left, no other node can take the row before it expires.
+
+        Returns:
+            bool: False if the claim was lost to another node.
+        """
+        lease_left = file_row.claim_expires_at - self.database_now() if file_row.claim_expires_at else timedelta(0)
+        if file_row.claimed_by == self.node_id and file_row.status == STATUS_PROCESSING and lease_left > timedelta(seconds=self.lease_seconds / 2):
+            return True
+
+        return self.extend_claim(file_row)
+
+    @timed_operation
+    def extend_claim(self, file_row):
+        """Move the lease of a row claimed by this node lease_seconds from now.
+
+        Returns:
+            bool: False if the claim was lost to another node.
+        """
+        session = self.session()
+        files = self.get_table('files')
+        renewed = session.query(files).filter(
+            files.id == file_row.id,
+            files.claimed_by == self.node_id,
+            files.status == STATUS_PROCESSING
+        ).update({
+            files.claim_expires_at: self.lease_expiry()
+        }, synchronize_session=False)
+        session.commit()
+
+        return renewed == 1
+
+    @timed_operation
+    def get_file_row(self, row_id):
+        session = self.session()
+        files = self.get_table('files')
+        return session.query(files).filter(files.id == row_id).one_or_none()
+
+    def update_file_row(self, file_row, fields_and_values: dict, owned=True):
+        """Queue an update of a files row, written by the next flush_writes.
+
+        Args:
+            owned (bool, optional): Only write while the row is claimed by this node, so a node whose claim expired
+                can not overwrite the result of the node which took the row over. Defaults to True.
+        """
+        self.writer.update('files', file_row.id, fields_and_values, owner=self.node_id if owned else None)
+
+    @timed_operation
     def delete_file_row(self, file_row):
+        self.writer.discard('files', file_row.id)
         session = self.session()
+        variants = self.get_table('file_variants')
+        session.query(variants).filter(variants.belongs_to == file_row.id).delete(synchronize_session=False)
+        timings = self.get_table('file_timings')
+        session.query(timings).filter(timings.belongs_to == file_row.id).delete(synchronize_session=False)
         session.delete(file_row)
         session.commit()
 
-    def set_runtime(self, fields_and_values: dict):
+    @timed_operation
+    def get_file_variants(self, file_row):
+        session = self.session()
+        variants = self.get_table('file_variants')
+        return session.query(variants).filter(variants.belongs_to == file_row.id).all()
+
+    @timed_operation
+    def set_file_variants(self, file_row, variants: list):
+        """Replace the recorded variants of a files row. Old records are deleted now, new ones are queued for the next flush_writes.
+
+        Args:
+            variants (list): Dicts of width, height, size and downloaded_path.
+        """
+        session = self.session()
+        table = self.get_table('file_variants')
+        session.query(table).filter(table.belongs_to == file_row.id).delete(synchronize_session=False)
+        session.commit()
+
+        for variant in variants:
+            self.writer.insert('file_variants', {'belongs_to': file_row.id, **variant})
+
+    def record_file_timing(self, file_row, fields: dict):
+        """Queue a timing breakdown of a processed files row for the next flush_writes.
+
+        Args:
+            fields (dict): Stage durations, status and byte counts from rowdo.timing.RowTimer.record.
+        """
+        self.writer.insert('file_timings', {'belongs_to': file_row.id, 'command': file_row.command, **fields})
+
+    @timed_operation
+    def flush_writes(self):
+        return self.writer.flush()
+
+    def get_presets_version(self):
+        """Cheap fingerprint of the presets table, changes when a preset is inserted, updated or deleted.
+
+        Returns:
+            tuple: Number of presets and their latest updated_at.
+        """
+        presets = self.get_table('presets')
+        session = self.session()
+        return tuple(session.query(func.count(presets.id), func.max(presets.updated_at)).one())
+
+    @timed_operation
+    def refresh_presets(self, version=None):
+        """Reload the in-memory presets if the presets table changed since they were last loaded.
+
+        Args:
+            version (tuple, optional): Version already read by get_presets_version, such as the parent process'. Defaults to reading it.
+
+        Returns:
+            bool: True if presets were reloaded.
+        """
+        if version is None:
+            version = self.get_presets_version()
+
+        if version == self.presets_version:
+            return False
+
+        presets = self.get_table('presets')
+        session = self.session()
+        self._presets = {
+            preset.id: SimpleNamespace(**{column.name: getattr(preset, column.name) for column in presets.__table__.columns})
+            for preset in session.query(presets)
+        }
+        self.presets_version = version
+        logger.debug(f'Loaded {len(self._presets)} presets.')
+        return True
+
+    def get_preset(self, preset_id):
+        """Cached preset, detached from any session so it can be shared by worker threads.
+        """
+        return self._presets.get(preset_id)
+
+    def _create_runtime(self, previous_version=None):
+        """Create the runtime row if missing and record the current schema version.
+        """
         session = self.session()
         runtime = self.get_table('runtime')
         exists = session.query(runtime).filter(runtime.id == 1).one_or_none()
         if not exists:
             logger.warning('Creating Runtime')
-            new = runtime(id=1, schema_version=__schema_version__, **fields_and_values)
-            session.add(new)
-        else:
-            self._update_row(exists, fields_and_values)
-        session.commit()
+            session.add(runtime(id=1, schema_version=__schema_version__))
+            try:
+                session.commit()
+            except IntegrityError:  # Created by another node.
+                session.rollback()
+        elif previous_version != __schema_version__:
+            exists.schema_version = __schema_version__
+            session.commit()
+        self.close_session()
 
+    @timed_operation
+    def set_runtime(self, fields_and_values: dict):
+        """Queue an update of the runtime row, written by the next flush_writes.
+        """
+        self.writer.update('runtime', 1, fields_and_values)
+
+    @timed_operation
     def get_runtime(self):
         runtime = self.get_table('runtime')
         session = self.session()
         return session.query(runtime).filter(runtime.id == 1).one_or_none()
 
+    @timed_operation
     def register_error(self, file, error):
-        session = self.session()
-        error_logs = self.get_table('error_logs')
-
+        """Queue an error log entry, written by the next flush_writes.
+        """
         if getattr(error, 'level', False):
             lvl = error.level
         else:
             lvl = rowdo.exceptions.CRITICAL
 
-        session.add(error_logs(
-            belongs_to=file.id,
-            message=error.message,
-            type=type(error).__name__,
-            level=lvl
-        ))
-        session.commit()
+        self.writer.insert('error_logs', {
+            'belongs_to': file.id,
+            'message': error.message,
+            'type': type(error).__name__,
+            'level': lvl
+        })
@@ -19,4 +19,4 @@ session.commit()
 
 db.register_error(new_file, RowdoException('test_error'))
 
-db.update_file_row(new_file, {'status': STATUS_ERROR})
+db.update_file_row(new_file, {'status': STATUS_ERROR}, owned=False)
@@ -0,0 +1,118 @@
+from sqlalchemy import inspect, select, text
+from sqlalchemy.schema import CreateColumn
+
+from rowdo.logging import logger
+
+
+def _version(version):
+    return tuple(int(part) for part in version.split('.'))
+
+
+def _add_column(engine, table, column_name):
+    column = table.__table__.c[column_name]
+    existing = [col['name'] for col in inspect(engine).get_columns(table.__tablename__)]
+    if column_name in existing:
+        return
+
+    ddl = CreateColumn(column).compile(dialect=engine.dialect)
+    logger.info(f'Adding column {table.__tablename__}.{column_name}')
+    with engine.begin() as connection:
+        connection.execute(text(f'ALTER TABLE {table.__tablename__} ADD COLUMN {ddl}'))
+
+
+def _create_index(engine, table, index_name):
+    index = next(index for index in table.__table__.indexes if index.name == index_name)
+    for existing in inspect(engine).get_indexes(table.__tablename__):
+        # Same name, or an index such as MySQL's implicit foreign key index already leading with the same columns.
+        if existing['name'] == index_name or existing['column_names'][:len(index.columns)] == [col.name for col in index.columns]:
+            return
+
+    logger.info(f'Creating index {index_name}')
+    index.create(engine)
+
+
+def _claims(engine, tables):
+    _add_column(engine, tables['files'], 'claimed_by')
+    _add_column(engine, tables['files'], 'claim_expires_at')
+
+
+def _runtime_cursor(engine, tables):
+    _add_column(engine, tables['runtime'], 'last_checked_id')
+
+
+def _indexes(engine, tables):
+    files = tables['files']
+    error_logs = tables['error_logs']
+    _create_index(engine, files, f'ix_{files.__tablename__}_status_updated_at_id')
+    _create_index(engine, error_logs, f'ix_{error_logs.__tablename__}_belongs_to')
+
+
+def _resize_filter(engine, tables):
+    _add_column(engine, tables['files'], 'resize_filter')
+
+
+def _resize_variants(engine, tables):
+    _add_column(engine, tables['files'], 'resize_variants')
+    _add_column(engine, tables['presets'], 'resize_variants')
+
+
+def _priority(engine, tables):
+    files = tables['files']
+    _add_column(engine, files, 'priority')
+    _create_index(engine, files, f'ix_{files.__tablename__}_status_priority_updated_at_id')
+
+
+def _next_attempt_at(engine, tables):
+    files = tables['files']
+    _add_column(engine, files, 'next_attempt_at')
+    _create_index(engine, files, f'ix_{files.__tablename__}_status_next_attempt_at')
+
+
+# Schema version -> step bringing a database of the previous version up to it. Steps must be idempotent.
+MIGRATIONS = [
+    ('0.2.0', _claims),
+    ('0.3.0', _runtime_cursor),
+    ('0.4.0', _indexes),
+    ('0.5.0', _resize_filter),
+    ('0.7.0', _resize_variants),
+    ('0.8.0', _priority),
+    ('0.9.0', _next_attempt_at),
+]
+
+
+def get_schema_version(engine, tables):
+    runtime = tables['runtime'].__table__
+    with engine.connect() as connection:
+        return connection.execute(select(runtime.c.schema_version).where(runtime.c.id == 1)).scalar()
+
+
+def is_new_schema(engine, tables):
+    """True before the tables are created for the first time, when create_all creates them in the declared schema.
+    """
+    return not inspect(engine).has_table(tables['files'].__tablename__)
+
+
+def migrate(engine, tables, new_schema=False):
+    """Bring tables created by an older rowdo version up to the declared schema.
+    Databases without a recorded schema version run every step, unless their tables were just created.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Database engine.
+        tables (dict): Declared tables by name.
+        new_schema (bool, optional): Tables were just created, checked with is_new_schema. Defaults to False.
+
+    Returns:
+        str: Schema version before the migration, None if not recorded.
+    """
+    current_version = get_schema_version(engine, tables)
+    if new_schema:
+        return current_version
+
+    for version, step in MIGRATIONS:
+        if current_version and _version(version) <= _version(current_version):
+            continue
+
+        logger.warning(f'Migrating database schema to {version}')
+        step(engine, tables)
+
+    return current_version
@@ -1,5 +1,8 @@
 from . import files
 from . import error_logs
 from . import runtime
+from . import presets
+from . import file_variants
+from . import file_timings
 
-modules = [files, error_logs, runtime]
+modules = [files, error_logs, runtime, presets, file_variants, file_timings]
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, DateTime, ForeignKey, Text, text
+from sqlalchemy import Column, Index, Integer, DateTime, ForeignKey, Text, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.schema import FetchedValue
@@ -22,6 +22,10 @@ def declare(base, prefix, table_name=TABLE_NAME):
 
     class ErrorLog(base):
         __tablename__ = table_name
+        __table_args__ = (
+            Index(f'ix_{table_name}_belongs_to', 'belongs_to'),
+            base.__table_args__
+        )
 
         id = Column(Integer, primary_key=True)
         belongs_to = Column(Integer, ForeignKey(f'{prefix}_files.id', ondelete="CASCADE"))
@@ -0,0 +1,43 @@
+from sqlalchemy import Column, Index, Integer, BigInteger, Float, DateTime, ForeignKey
+from sqlalchemy.sql import func
+
+
+TABLE_NAME = 'file_timings'
+
+
+def declare(base, prefix, table_name=TABLE_NAME):
+    """Create a declared instance of SqlAlchemy Table
+
+    Args:
+        base (sqlalchemy.ext.declarative.declarative_base()): SqlAlchemy Declarative Base
+        prefix (str): Global table prefix
+        table_name (str, optional): Table name. Defaults to TABLE_NAME.
+
+    Returns:
+        sqlalchemy.ext.declarative.declarative_base(): SqlAlchemy Table
+    """
+    table_name = f'{prefix}_{table_name}'
+
+    class FileTiming(base):
+        __tablename__ = table_name
+        __table_args__ = (
+            Index(f'ix_{table_name}_belongs_to', 'belongs_to'),
+            base.__table_args__
+        )
+
+        id = Column(Integer, primary_key=True)
+        belongs_to = Column(Integer, ForeignKey(f'{prefix}_files.id', ondelete="CASCADE"), nullable=False)
+        command = Column(Integer)
+        status = Column(Integer)
+        head_ms = Column(Float)
+        request_ms = Column(Float)
+        mime_ms = Column(Float)
+        download_ms = Column(Float)
+        copy_ms = Column(Float)
+        resize_ms = Column(Float)
+        write_ms = Column(Float)
+        total_ms = Column(Float)
+        bytes_downloaded = Column(BigInteger)
+        output_bytes = Column(BigInteger)
+        created_at = Column(DateTime, server_default=func.now())
+    return FileTiming
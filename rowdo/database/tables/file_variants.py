@@ -0,0 +1,37 @@
+from sqlalchemy import Column, Index, Integer, DateTime, ForeignKey, Text, text
+from sqlalchemy.sql import func
+from sqlalchemy.schema import FetchedValue
+
+
+TABLE_NAME = 'file_variants'
+
+
+def declare(base, prefix, table_name=TABLE_NAME):
+    """Create a declared instance of SqlAlchemy Table
+
+    Args:
+        base (sqlalchemy.ext.declarative.declarative_base()): SqlAlchemy Declarative Base
+        prefix (str): Global table prefix
+        table_name (str, optional): Table name. Defaults to TABLE_NAME.
+
+    Returns:
+        sqlalchemy.ext.declarative.declarative_base(): SqlAlchemy Table
+    """
+    table_name = f'{prefix}_{table_name}'
+
+    class FileVariant(base):
+        __tablename__ = table_name
+        __table_args__ = (
+            Index(f'ix_{table_name}_belongs_to', 'belongs_to'),
+            base.__table_args__
+        )
+
+        id = Column(Integer, primary_key=True)
+        belongs_to = Column(Integer, ForeignKey(f'{prefix}_files.id', ondelete="CASCADE"), nullable=False)
+        width = Column(Integer)
+        height = Column(Integer)
+        size = Column(Integer)
+        downloaded_path = Column(Text)
+        created_at = Column(DateTime, server_default=func.now())
+        updated_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"), server_onupdate=FetchedValue())
+    return FileVariant
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Text, Numeric, DateTime, text
+from sqlalchemy import Column, Index, Integer, String, Text, Numeric, DateTime, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.schema import FetchedValue
@@ -21,6 +21,15 @@ def declare(base, prefix, table_name=TABLE_NAME):
 
     class File(base):
         __tablename__ = table_name
+        __table_args__ = (
+            # Polling and claiming: status IN (...) AND (updated_at, id) > cursor ORDER BY updated_at, id
+            Index(f'ix_{table_name}_status_updated_at_id', 'status', 'updated_at', 'id'),
+            # Priority lanes: status IN (...) AND priority = ? ORDER BY updated_at, id
+            Index(f'ix_{table_name}_status_priority_updated_at_id', 'status', 'priority', 'updated_at', 'id'),
+            # Due retries: status IN (...) AND next_attempt_at <= now ORDER BY next_attempt_at
+            Index(f'ix_{table_name}_status_next_attempt_at', 'status', 'next_attempt_at'),
+            base.__table_args__
+        )
 
         id = Column(Integer, primary_key=True)
         url = Column(Text, nullable=False)
@@ -29,12 +38,18 @@ def declare(base, prefix, table_name=TABLE_NAME):
         resize_width = Column(Integer)
         resize_height = Column(Integer)
         resize_ratio = Column(Numeric(10, 5))
+        resize_filter = Column(String(16))
+        resize_variants = Column(Text)
         command = Column(Integer, server_default='1', nullable=False)
         status = Column(Integer, server_default='0', nullable=False)
         failed_attempts = Column(Integer, server_default='0', nullable=False)
+        priority = Column(Integer, server_default='0', nullable=False)
         preset_id = Column(Integer)
         downloaded_path = Column(Text)
+        claimed_by = Column(String(255))
+        claim_expires_at = Column(DateTime)
+        next_attempt_at = Column(DateTime)
         created_at = Column(DateTime, server_default=func.now(), nullable=False)
-        updated_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"), server_onupdate=FetchedValue(), nullable=False)
+        updated_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"), onupdate=func.now(), server_onupdate=FetchedValue(), nullable=False)
         errors = relationship('ErrorLog', back_populates="parent", viewonly=False)
     return File
@@ -0,0 +1,36 @@
+from sqlalchemy import Column, Integer, String, Text, Numeric, DateTime, text
+from sqlalchemy.sql import func
+from sqlalchemy.schema import FetchedValue
+
+TABLE_NAME = 'presets'
+
+
+def declare(base, prefix, table_name=TABLE_NAME):
+    """Create a declared instance of SqlAlchemy Table
+
+    Args:
+        base (sqlalchemy.ext.declarative.declarative_base()): SqlAlchemy Declarative Base
+        prefix (str): Global table prefix
+        table_name (str, optional): Table name. Defaults to TABLE_NAME.
+
+    Returns:
+        sqlalchemy.ext.declarative.declarative_base(): SqlAlchemy Table
+    """
+    table_name = f'{prefix}_{table_name}'
+
+    class Preset(base):
+        __tablename__ = table_name
+
+        id = Column(Integer, primary_key=True)
+        name = Column(String(255))
+        resize_mode = Column(Integer, server_default='-1', nullable=False)
+        resize_width = Column(Integer)
+        resize_height = Column(Integer)
+        resize_ratio = Column(Numeric(10, 5))
+        resize_filter = Column(String(16))
+        resize_variants = Column(Text)
+        output_format = Column(String(16))
+        quality = Column(Integer)
+        created_at = Column(DateTime, server_default=func.now(), nullable=False)
+        updated_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"), onupdate=func.now(), server_onupdate=FetchedValue(), nullable=False)
+    return Preset
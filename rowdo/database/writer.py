@@ -0,0 +1,146 @@
+import threading
+from time import monotonic, sleep
+
+from sqlalchemy import bindparam, insert, update
+
+from rowdo.logging import logger
+
+
+class WriteBehind:
+    """Collects row updates and inserts in memory and writes them in bulk.
+
+    Updates to the same row are merged, updates sharing the same columns are sent as one executemany UPDATE
+    and inserts to the same table as one executemany INSERT, all in a single transaction.
+    Pending writes are flushed when batch_size is reached, when the oldest one is older than flush_seconds,
+    or when flush() is called. Age is also checked by a background thread, so a finished row's status is written
+    in time while every worker is busy with a long download and nothing else is queued.
+
+    If a flush fails its writes are dropped. Rows are left processing and are recovered once their claim expires.
+    Updates queued with an owner are only written while the row is still claimed by it.
+    """
+    def __init__(self, session_maker, tables: dict, batch_size=100, flush_seconds=1.0):
+        self._session_maker = session_maker
+        self._tables = tables
+        self.batch_size = max(int(batch_size), 1)
+        self.flush_seconds = float(flush_seconds)
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._updates = {}  # (table name, row id) -> fields
+        self._owners = {}  # (table name, row id) -> claimed_by the update requires
+        self._inserts = []  # (table name, fields)
+        self._first_queued_at = None
+        self._timer = None
+
+    def __len__(self):
+        return len(self._updates) + len(self._inserts)
+
+    def update(self, table_name, row_id, fields_and_values: dict, owner=None):
+        """
+        Args:
+            owner (str, optional): Only write if the row's claimed_by is still this, checked when flushed.
+        """
+        with self._lock:
+            self._updates.setdefault((table_name, row_id), {}).update(fields_and_values)
+            if owner is not None:
+                self._owners[(table_name, row_id)] = owner
+            self._queued()
+
+        self._flush_if_due()
+
+    def insert(self, table_name, fields_and_values: dict):
+        with self._lock:
+            self._inserts.append((table_name, fields_and_values))
+            self._queued()
+
+        self._flush_if_due()
+
+    def discard(self, table_name, row_id):
+        """Drop pending updates of a row, call before the row is deleted.
+        """
+        with self._lock:
+            self._updates.pop((table_name, row_id), None)
+            self._owners.pop((table_name, row_id), None)
+
+    def _queued(self):
+        if self._first_queued_at is None:
+            self._first_queued_at = monotonic()
+
+        if self._timer is None and self.flush_seconds > 0:
+            self._timer = threading.Thread(target=self._flush_timer, name='rowdo-write-behind', daemon=True)
+            self._timer.start()
+
+    def _seconds_until_due(self):
+        first_queued_at = self._first_queued_at
+        if first_queued_at is None:
+            return self.flush_seconds
+
+        return max(first_queued_at + self.flush_seconds - monotonic(), 0.01)
+
+    def _flush_timer(self):
+        while True:
+            sleep(self._seconds_until_due())
+            try:
+                self._flush_if_due()
+            except Exception:  # Logged by flush, writes of the next interval go on.
+                pass
+
+    def _flush_if_due(self):
+        first_queued_at = self._first_queued_at
+        if len(self) >= self.batch_size or (first_queued_at is not None and monotonic() - first_queued_at >= self.flush_seconds):
+            self.flush()
+
+    def _take(self):
+        with self._lock:
+            updates, owners, inserts = self._updates, self._owners, self._inserts
+            self._updates, self._owners, self._inserts = {}, {}, []
+            self._first_queued_at = None
+
+        return updates, owners, inserts
+
+    def flush(self):
+        """Write every pending update and insert in one transaction.
+
+        Returns:
+            int: Number of written rows.
+        """
+        with self._flush_lock:  # Keeps writes to the same row in queue order.
+            updates, owners, inserts = self._take()
+            if not updates and not inserts:
+                return 0
+
+            update_groups = {}
+            for (table_name, row_id), fields in updates.items():
+                owner = owners.get((table_name, row_id))
+                key = (table_name, tuple(sorted(fields)), owner is not None)
+                parameters = {'_id': row_id, '_owner': owner, **{f'_{name}': value for name, value in fields.items()}}
+                update_groups.setdefault(key, []).append(parameters)
+
+            insert_groups = {}
+            for table_name, fields in inserts:
+                insert_groups.setdefault((table_name, tuple(sorted(fields))), []).append(fields)
+
+            session = self._session_maker()
+            try:
+                for (table_name, names, owned), parameters in update_groups.items():
+                    table = self._tables[table_name].__table__
+                    statement = update(table).where(table.c.id == bindparam('_id'))
+                    if owned:
+                        statement = statement.where(table.c.claimed_by == bindparam('_owner'))
+                    result = session.execute(statement.values({name: bindparam(f'_{name}') for name in names}), parameters)
+                    if owned and result.rowcount < len(parameters):
+                        logger.warning(f'{len(parameters) - result.rowcount} updates skipped, rows were claimed by another node.')
+
+                for (table_name, names), parameters in insert_groups.items():
+                    session.execute(insert(self._tables[table_name].__table__), parameters)
+
+                session.commit()
+            except Exception as err:
+                session.rollback()
+                logger.error(f'Write behind flush failed, {len(updates) + len(inserts)} writes dropped. {err}')
+                raise
+            finally:
+                session.close()
+
+            logger.trace(f'Write behind flushed {len(updates)} updates and {len(inserts)} inserts.')
+            return len(updates) + len(inserts)
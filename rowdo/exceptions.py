@@ -28,6 +28,7 @@ class ResizeModeException(RowdoException):
 class RequestError(RowdoException):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.retry_after = kwargs.get('retry_after')  # Seconds the server asked to wait with Retry-After.
 
 
 class FileNameError(RowdoException):
@@ -43,3 +44,15 @@ class BlackListException(RowdoException):
 class FileAccessError(RowdoException):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+
+
+class PresetError(RowdoException):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+class ClaimLostError(RowdoException):
+    """Row was reclaimed by another node while it was processed, this node leaves it alone.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
@@ -0,0 +1,249 @@
+import threading
+from time import monotonic
+from urllib.parse import urlsplit
+
+from rowdo.logging import logger
+from rowdo.urlmatch import normalize_url
+
+
+BACKOFF_STATUSES = (429, 503)  # Responses which slow down every download from their host.
+
+
+def host_of(url):
+    """
+    Returns:
+        str: `scheme://host[:port]` of a URL, downloads are scheduled per host.
+    """
+    parts = urlsplit(normalize_url(url))
+    return f'{parts.scheme}://{parts.netloc.rsplit("@", 1)[-1]}'
+
+
+def parse_limits(entries):
+    """Parse `prefix rate concurrency` entries of config.hosts.limits.
+
+    Returns:
+        list: (prefix, requests per second, concurrency) tuples, longest prefix first.
+    """
+    limits = []
+    for entry in entries:
+        fields = entry.split()
+        if not fields:
+            continue
+
+        try:
+            rate = float(fields[1]) if len(fields) > 1 else 0.0
+            concurrency = int(fields[2]) if len(fields) > 2 else 0
+        except ValueError:
+            logger.warning(f'Invalid host limit, ignored: {entry}')
+            continue
+
+        limits.append((fields[0], rate, concurrency))
+
+    return sorted(limits, key=lambda limit: len(limit[0]), reverse=True)
+
+
+class HostState:
+    def __init__(self, rate, burst, concurrency):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.tokens = burst
+        self.updated = monotonic()
+        self.running = 0
+        self.blocked_until = 0.0
+        self.strikes = 0
+
+    def refill(self, now):
+        if self.rate:
+            self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.burst)
+        self.updated = now
+
+    def token_wait(self, queued=1):
+        """Seconds until the token of the queued-th next request is available.
+        """
+        if not self.rate or self.tokens >= queued:
+            return 0.0
+
+        return (queued - self.tokens) / self.rate
+
+    def is_idle(self, now):
+        return not self.running and self.blocked_until <= now and (not self.rate or self.tokens >= self.burst)
+
+
+class HostScheduler:
+    """Decides which group of rows of a batch starts next, so one host can not starve the others or be hammered.
+
+    Every host has a token bucket refilled at its requests per second up to burst and a cap of concurrently
+    running groups. Hosts take turns in round robin order, and a host answering 429 or 503 is paused for its
+    Retry-After, or an exponentially growing backoff without one.
+    A rate or concurrency of 0 is unlimited. Groups without a host, such as deletions, start right away.
+
+    Scheduling calls never block, watchers wait for the returned number of seconds their own way.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+        self._reported = set()  # Hosts backed off since the last drain_backoffs.
+        self.configure([])
+
+    def configure(self, limits, rate=0.0, burst=1.0, concurrency=0, backoff_seconds=30.0, max_backoff_seconds=600.0):
+        """Apply settings, hosts keep their running count and backoff.
+
+        Args:
+            limits (list): `prefix rate concurrency` entries overriding rate and concurrency for matching hosts.
+        """
+        with self._lock:
+            self._limits = parse_limits(limits)
+            self.rate = rate
+            self.burst = max(burst, 1.0)
+            self.concurrency = concurrency
+            self.backoff_seconds = backoff_seconds
+            self.max_backoff_seconds = max_backoff_seconds
+            for host, state in self._states.items():
+                state.rate, state.concurrency = self._limit(host)
+                state.burst = self.burst
+
+    def _limit(self, host):
+        matched = f'{host}/'
+        for prefix, rate, concurrency in self._limits:
+            if prefix == '*' or matched.startswith(prefix):
+                return rate, concurrency
+
+        return self.rate, self.concurrency
+
+    def _state(self, host):
+        state = self._states.get(host)
+        if not state:
+            rate, concurrency = self._limit(host)
+            state = self._states[host] = HostState(rate, self.burst, concurrency)
+
+        return state
+
+    @staticmethod
+    def interleave(items):
+        """Order (host, group) pairs round robin across hosts, keeping each host's own order.
+        """
+        queues = {}
+        for host, group in items:
+            queues.setdefault(host, []).append((host, group))
+
+        ordered = []
+        for turn in range(max(map(len, queues.values()), default=0)):
+            ordered.extend(queue[turn] for queue in queues.values() if turn < len(queue))
+
+        return ordered
+
+    def take(self, pending):
+        """Remove the first (host, group) pair of pending whose host can start a request now, and count it as running.
+
+        Returns:
+            tuple: The pair, None if none can start. Seconds until one may be able to, None to wait for a running group.
+        """
+        now = monotonic()
+        wait = None
+        with self._lock:
+            seen = set()
+            for index, (host, _) in enumerate(pending):
+                if host is None:
+                    return pending.pop(index), 0.0
+                if host in seen:
+                    continue
+                seen.add(host)
+
+                state = self._state(host)
+                state.refill(now)
+                if state.concurrency and state.running >= state.concurrency:
+                    continue
+
+                host_wait = max(state.blocked_until - now, state.token_wait())
+                if host_wait > 0:
+                    wait = host_wait if wait is None else min(wait, host_wait)
+                    continue
+
+                if state.rate:
+                    state.tokens -= 1
+                state.running += 1
+                return pending.pop(index), 0.0
+
+        return None, wait
+
+    def release(self, host):
+        if host is None:
+            return
+
+        with self._lock:
+            self._states[host].running -= 1
+
+    def pop_blocked(self, pending, max_wait):
+        """Remove pairs which would wait longer than max_wait for a backoff to end or for their token.
+
+        Returns:
+            list: Removed pairs, to be left for a later routine.
+        """
+        now = monotonic()
+        blocked, kept, queued = [], [], {}
+        with self._lock:
+            for host, group in pending:
+                if host is not None:
+                    state = self._state(host)
+                    state.refill(now)
+                    queued[host] = queued.get(host, 0) + 1
+                    if max(state.blocked_until - now, state.token_wait(queued[host])) > max_wait:
+                        blocked.append((host, group))
+                        continue
+
+                kept.append((host, group))
+
+        pending[:] = kept
+        return blocked
+
+    def backoff(self, url, seconds=None):
+        """Pause a host after a 429 or 503 response, for seconds or a backoff doubling with each one in a row.
+        """
+        host = host_of(url)
+        with self._lock:
+            state = self._state(host)
+            state.strikes += 1
+            if seconds is None:
+                seconds = self.backoff_seconds * 2 ** (state.strikes - 1)
+            seconds = min(seconds, self.max_backoff_seconds)
+            state.blocked_until = max(state.blocked_until, monotonic() + seconds)
+            self._reported.add(host)
+
+        logger.warning(f'Host {host} asked to slow down, pausing it for {seconds:.1f} seconds.')
+
+    def succeeded(self, url):
+        host = host_of(url)
+        with self._lock:
+            state = self._states.get(host)
+            if state:
+                state.strikes = 0
+
+    def drain_backoffs(self):
+        """
+        Returns:
+            dict: Seconds left of each backoff started since the last call, to pass to another scheduler.
+        """
+        now = monotonic()
+        with self._lock:
+            backoffs = {host: self._states[host].blocked_until - now for host in self._reported}
+            self._reported.clear()
+
+        return {host: seconds for host, seconds in backoffs.items() if seconds > 0}
+
+    def merge_backoffs(self, backoffs):
+        now = monotonic()
+        with self._lock:
+            for host, seconds in (backoffs or {}).items():
+                state = self._state(host)
+                state.blocked_until = max(state.blocked_until, now + seconds)
+
+    def prune(self):
+        """Forget hosts with nothing running, waiting or blocked.
+        """
+        now = monotonic()
+        with self._lock:
+            for host, state in list(self._states.items()):
+                state.refill(now)
+                if state.is_idle(now):
+                    del self._states[host]
@@ -0,0 +1,92 @@
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import rowdo.config as config
+from rowdo.hosts import BACKOFF_STATUSES
+
+
+class RowdoSession(requests.Session):
+    """requests.Session with a default timeout for every request.
+    """
+    def __init__(self, timeout=None):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(*args, **kwargs)
+
+
+def retry_statuses():
+    """Statuses of config.download.retry_statuses retried right away by the transport.
+    429 and 503 are left out: their host is paused by HostScheduler and their row is retried at next_attempt_at,
+    instead of a worker sleeping through Retry-After.
+    """
+    codes = [int(code) for code in config.get('download', 'retry_statuses', return_type=list) if code]
+    return [code for code in codes if code not in BACKOFF_STATUSES]
+
+
+def create_session():
+    """Create a pooled HTTP session configured from config.download.
+
+    Returns:
+        RowdoSession: Session shared by the watcher, safe to use from worker threads.
+    """
+    connect_timeout = config.get('download', 'connect_timeout')
+    read_timeout = config.get('download', 'read_timeout')
+    session = RowdoSession(timeout=(connect_timeout, read_timeout))
+
+    retries = config.get('download', 'retries')
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=config.get('download', 'retry_backoff'),
+        status_forcelist=retry_statuses(),
+        raise_on_status=False,  # Let raise_for_status report the final response.
+        respect_retry_after_header=False  # Backoff only, a Retry-After is never slept through in a worker.
+    )
+
+    adapter = HTTPAdapter(
+        pool_connections=config.get('download', 'pool_connections'),
+        pool_maxsize=config.get('download', 'pool_maxsize'),
+        pool_block=config.get('download', 'pool_block'),
+        max_retries=retry
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    if not config.get('download', 'keep_alive'):
+        session.headers['Connection'] = 'close'
+
+    return session
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header, given either as seconds or as an HTTP date.
+
+    Returns:
+        float: Seconds, None if header is missing or malformed.
+    """
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
@@ -0,0 +1,154 @@
+import io
+import os
+import math
+
+from PIL import Image
+
+from rowdo.logging import logger
+import rowdo.exceptions as exceptions
+
+
+RESAMPLE_FILTERS = {
+    'nearest': Image.NEAREST,
+    'box': Image.BOX,
+    'bilinear': Image.BILINEAR,
+    'hamming': Image.HAMMING,
+    'bicubic': Image.BICUBIC,
+    'lanczos': Image.LANCZOS
+}
+
+MODE_RATIO = 'RATIO'
+MODE_DIMENSIONS = 'DIMENSIONS'
+
+
+def image_format(path):
+    """PIL format name from the file extension, same lookup PIL.Image.save does with a filename.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in Image.registered_extensions():
+        Image.init()
+
+    return Image.registered_extensions()[extension]
+
+
+def get_resample(name):
+    try:
+        return RESAMPLE_FILTERS[name.lower()]
+    except (KeyError, AttributeError):
+        raise exceptions.ResizeException(f'Unknown resize filter: {name}', level=exceptions.ERROR)
+
+
+def target_size(size, mode, *args):
+    """Output size of an image for a resize mode.
+
+    Args:
+        size (tuple): Source width and height.
+        mode (str): MODE_RATIO with a ratio or MODE_DIMENSIONS with width and height.
+
+    Returns:
+        tuple: Width and height.
+    """
+    if mode == MODE_RATIO:
+        if len(args) < 1 or not args[0]:  # In case it is None or zero.
+            raise exceptions.ResizeException('Resize ratio was missing.', level=exceptions.ERROR)
+
+        try:
+            resize_ratio = float(args[0])
+        except (TypeError, ValueError) as err:  # Invalid row.resize_ratio
+            raise exceptions.ResizeException(f"Resize ratio is not valid. {err}", level=exceptions.ERROR)
+
+        return math.ceil(size[0] * resize_ratio), math.ceil(size[1] * resize_ratio)
+
+    if mode == MODE_DIMENSIONS:
+        if len(args) < 2:
+            raise exceptions.ResizeException('Resize width or height was missing.', level=exceptions.ERROR)
+
+        if not (args[0] and args[1]):
+            raise exceptions.ResizeException('Resize width or height is zero.', level=exceptions.ERROR)
+
+        return int(args[0]), int(args[1])
+
+    raise exceptions.ResizeModeException('Invalid resize mode.', level=exceptions.ERROR)
+
+
+def resize_image(img, size, resample=Image.BICUBIC, reducing_gap=None, draft=True):
+    """Resize an opened image. JPEG images are decoded at a reduced scale when shrinking with draft.
+    """
+    if draft and img.format == 'JPEG' and size[0] < img.width and size[1] < img.height:
+        img.draft(img.mode, size)  # Picks a DCT scale keeping the image at least as big as size.
+
+    if img.size == size:
+        return img
+
+    return img.resize(size, resample, reducing_gap=reducing_gap or None)
+
+
+def save_image(img, output, output_format, quality=None, optimize=False, progressive=False):
+    """Encode image into an open file.
+    """
+    options = {}
+    if quality:
+        options['quality'] = quality
+    if optimize:
+        options['optimize'] = True
+    if progressive:
+        options['progressive'] = True
+
+    img.save(output, format=output_format, **options)
+
+
+def variant_size(size, width):
+    """Size of a variant of the given width, keeping the aspect ratio of size.
+    """
+    return width, max(round(size[1] * width / size[0]), 1)
+
+
+def _save_output(img, output_path, output_format, quality, optimize, progressive):
+    with open(output_path, 'xb') as output:
+        save_image(img, output, output_format, quality, optimize, progressive)
+
+    return {'path': output_path, 'size': img.size, 'bytes': os.path.getsize(output_path)}
+
+
+def render(source, output_path, output_format, mode, args, variants=(), resample='bicubic', reducing_gap=None, draft=True, quality=None, optimize=False, progressive=False):
+    """Resize an image file or image bytes into output_path and each variant path, decoding the source once.
+    Main output is skipped when mode is None, or when the image would be saved with the same size and format,
+    the source can be used as it is then. Outputs are built largest first, each one from the previous when it is big enough.
+    Arguments and result are picklable, so renders can run in a process pool.
+
+    Args:
+        variants (list): (output path, width) of additional outputs keeping the aspect ratio.
+
+    Returns:
+        tuple: Main output as a dict of path, pixel size and file size in bytes, None if it was skipped. List of variant outputs.
+    """
+    resample = get_resample(resample)
+    try:
+        with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+            targets = [(path, variant_size(img.size, width), False) for path, width in variants]
+            if mode:
+                size = target_size(img.size, mode, *args)
+                if size == img.size and img.format == output_format:
+                    logger.trace(f'Resize skipped, same size and format: {size} {output_format}')
+                else:
+                    targets.append((output_path, size, True))
+
+            output, variant_outputs = None, []
+            previous = img
+            for path, size, is_main in sorted(targets, key=lambda target: target[1], reverse=True):
+                logger.trace(f'Resize Image, Mode:{mode} Args: {args} Size: {img.size} -> {size}')
+                base = previous if previous.width >= size[0] and previous.height >= size[1] else img
+                previous = resize_image(base, size, resample, reducing_gap, draft)  # First one drafts JPEGs for the largest output.
+                result = _save_output(previous, path, output_format, quality, optimize, progressive)
+                if is_main:
+                    output = result
+                else:
+                    variant_outputs.append(result)
+    except (Image.DecompressionBombError, SyntaxError) as err:
+        raise exceptions.ResizeException(f'Image could not be decoded. {err}', level=exceptions.ERROR)
+    except OSError as err:
+        if not getattr(err, 'filename', None):  # PIL decode and encode errors, file system errors carry a filename.
+            raise exceptions.ResizeException(f'Image could not be processed. {err}', level=exceptions.ERROR)
+        raise
+
+    return output, variant_outputs
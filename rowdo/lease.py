@@ -0,0 +1,61 @@
+from time import monotonic
+from contextvars import ContextVar
+
+import rowdo.exceptions as exceptions
+
+
+_current = ContextVar('rowdo_claim_lease', default=None)
+
+
+class ClaimLease:
+    """Keeps the claim of a row while it is processed, so a long download or resize is not taken over
+    by another node's recover_stale_claims. The lease is extended once half of it has passed.
+    """
+    def __init__(self, db, row):
+        self.db = db
+        self.row = row
+        self.renew_at = monotonic()
+        if row.claim_expires_at:
+            lease_left = (row.claim_expires_at - db.database_now()).total_seconds()
+            self.renew_at += max(lease_left - db.lease_seconds / 2, 0)
+
+    def due(self):
+        return monotonic() >= self.renew_at
+
+    def renew(self):
+        """Extend the lease now. Raises ClaimLostError if another node owns the row.
+        """
+        if not self.db.extend_claim(self.row):
+            raise exceptions.ClaimLostError(f'Claim lost while processing. ID:{self.row.id}', level=exceptions.WARNING)
+
+        self.renew_at = monotonic() + self.db.lease_seconds / 2
+
+    def keep(self):
+        if self.due():
+            self.renew()
+
+
+def current():
+    """
+    Returns:
+        ClaimLease: Lease of the row processed in this thread or task, None outside of a row.
+    """
+    return _current.get()
+
+
+def activate(lease):
+    """Make lease the current one. Returns a token for deactivate.
+    """
+    return _current.set(lease)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+def keep():
+    """Renew the current row's lease if it is due. Cheap enough to call for every chunk.
+    """
+    lease = _current.get()
+    if lease is not None:
+        lease.keep()
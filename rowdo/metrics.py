@@ -0,0 +1,208 @@
+import threading
+from time import perf_counter
+from bisect import bisect_left
+from functools import wraps
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from rowdo.logging import logger
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metric:
+    """In process metric with labels, rendered in the Prometheus text format.
+    Values are kept per tuple of label values in the order of label_names.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def _format_labels(self, key, extra=()):
+        pairs = list(zip(self.label_names, key)) + list(extra)
+        if not pairs:
+            return ''
+
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def samples(self):
+        with self._lock:
+            return [f'{self.name}{self._format_labels(key)} {value}' for key, value in sorted(self._values.items())]
+
+    def drain(self):
+        """Take the values added since the last drain, to pass to another process.
+        """
+        with self._lock:
+            values, self._values = self._values, {}
+
+        return values
+
+    def merge(self, values):
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0) + value
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def drain(self):
+        return {}  # Gauges are set by the process serving them.
+
+
+class Histogram(Metric):
+    """Histogram of observed values, each value is counted in the first bucket it fits and the cumulative
+    counts are built when rendered.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]  # Buckets, +Inf, sum.
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - started, **labels)
+
+    def samples(self):
+        lines = []
+        with self._lock:
+            for key, counts in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{self.name}_bucket{self._format_labels(key, [("le", le)])} {cumulative}')
+                lines.append(f'{self.name}_sum{self._format_labels(key)} {counts[-1]}')
+                lines.append(f'{self.name}_count{self._format_labels(key)} {cumulative}')
+
+        return lines
+
+    def merge(self, values):
+        with self._lock:
+            for key, counts in values.items():
+                current = self._values.get(key)
+                self._values[key] = list(counts) if current is None else [a + b for a, b in zip(current, counts)]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+
+        return '\n'.join(lines) + '\n'
+
+    def drain(self):
+        """
+        Returns:
+            dict: Values added to each metric since the last drain, by metric name.
+        """
+        return {metric.name: values for metric in self._metrics for values in [metric.drain()] if values}
+
+    def merge(self, drained):
+        metrics = {metric.name: metric for metric in self._metrics}
+        for name, values in (drained or {}).items():
+            metrics[name].merge(values)
+
+
+REGISTRY = Registry()
+
+ROWS_PROCESSED = Counter('rowdo_rows_processed_total', 'Rows processed by command and resulting status.', ('command', 'status'))
+QUEUE_ROWS = Gauge('rowdo_queue_rows', 'Rows of the files table by status, counted when a routine starts.', ('status',))
+POLL_LAG = Gauge('rowdo_poll_lag_seconds', 'Age of the oldest row waiting to process when a routine starts.')
+ROUTINE_SECONDS = Histogram('rowdo_routine_seconds', 'Duration of polling routines.')
+DOWNLOAD_BYTES = Counter('rowdo_download_bytes_total', 'Bytes downloaded by host.', ('host',))
+DOWNLOAD_SECONDS = Histogram('rowdo_download_seconds', 'Duration of downloads from request to the last byte by host.', ('host',))
+RESIZE_SECONDS = Histogram('rowdo_resize_seconds', 'Duration of image resizes with their variants by resize mode.', ('mode',))
+DB_SECONDS = Histogram('rowdo_db_seconds', 'Duration of database operations, including their commits.', ('operation',))
+
+
+def timed_operation(func):
+    """Record the duration of a Database method in DB_SECONDS, labelled with the method name.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with DB_SECONDS.time(operation=func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.trace(f'Metrics request: {format % args}')
+
+
+def start_server(host, port):
+    """Serve /metrics from a daemon thread.
+
+    Returns:
+        ThreadingHTTPServer: Running server.
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='rowdo-metrics', daemon=True).start()
+    logger.info(f'Serving metrics on http://{host}:{server.server_port}/metrics')
+    return server
@@ -0,0 +1,108 @@
+import os
+import json
+
+from rowdo.logging import logger
+
+
+class PartialDownload:
+    """Partly downloaded body of a row, kept between attempts to resume it with a `Range` request.
+
+    The body is written to `.rowdo-row-<id>.part` in the download directory. Its URL, total length and validator
+    are recorded next to it in `.rowdo-row-<id>.part.json` before the body is read, so a crashed download can be resumed too.
+    Bodies are only resumed with a validator: a strong ETag or a Last-Modified date sent as `If-Range`,
+    so a changed file is downloaded again from the start instead of being stitched together.
+    """
+    def __init__(self, directory, row_id, url):
+        self.path = os.path.join(directory, f'.rowdo-row-{row_id}.part')
+        self.meta_path = f'{self.path}.json'
+        self.url = url
+        self.size = 0
+        self.validator = None
+
+    def load(self):
+        """Read the kept part of a previous attempt.
+
+        Returns:
+            bool: True if it can be resumed.
+        """
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+            size = os.path.getsize(self.path)
+        except (OSError, ValueError):
+            return False
+
+        length = meta.get('length')
+        if meta.get('url') != self.url or not meta.get('validator') or not size or (length and size >= length):
+            return False
+
+        self.size = size
+        self.validator = meta['validator']
+        return True
+
+    def range_headers(self):
+        return {'Range': f'bytes={self.size}-', 'If-Range': self.validator}
+
+    def begin(self, status, headers):
+        """Prepare the part file for a response.
+
+        Args:
+            status (int): HTTP status of the response.
+            headers (dict): Response headers.
+
+        Returns:
+            bool: True if the response continues the kept part, False if the part was started over.
+        """
+        content_range = headers.get('content-range') or ''
+        resumed = bool(self.size) and status == 206 and content_range.startswith(f'bytes {self.size}-')
+        if resumed:
+            logger.debug(f'Resuming download at byte {self.size}: {self.url}')
+            return True
+
+        self.size = 0
+        length = headers.get('content-length')
+        etag = headers.get('etag')
+        self.validator = etag if etag and not etag.startswith('W/') else headers.get('last-modified')
+        self._write_meta({
+            'url': self.url,
+            'validator': self.validator,
+            'length': int(length) if length and length.isdigit() else None
+        })
+        open(self.path, 'wb').close()
+        return False
+
+    def _write_meta(self, meta):
+        temp_meta_path = f'{self.meta_path}.tmp'
+        with open(temp_meta_path, 'w', encoding='utf-8') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(temp_meta_path, self.meta_path)
+
+    def finish(self):
+        """Body is complete, forget the record. The part file itself is moved away by its row.
+        """
+        self._remove(self.meta_path)
+
+    def keep_or_discard(self, min_bytes):
+        """After a failed attempt, keep the part if it is worth resuming.
+        """
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+
+        if self.validator and size >= min_bytes:
+            logger.debug(f'Keeping {size} bytes of partial download: {self.url}')
+            return
+
+        self.discard()
+
+    def discard(self):
+        self._remove(self.path)
+        self._remove(self.meta_path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,89 @@
+from time import perf_counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+STAGES = ('head', 'request', 'mime', 'download', 'copy', 'resize', 'write')
+
+_current = ContextVar('rowdo_row_timer', default=None)
+
+
+class RowTimer:
+    """Time spent by a row in each processing stage, with its downloaded and saved bytes.
+
+    Stages are exclusive: time of a stage entered inside another one is only counted for the inner stage,
+    so stages add up to at most the total.
+    """
+    def __init__(self):
+        self.started = perf_counter()
+        self.stages = {}
+        self.bytes_downloaded = None
+        self.output_bytes = None
+        self._stack = []  # [name, started, time of inner stages]
+
+    @contextmanager
+    def stage(self, name):
+        frame = [name, perf_counter(), 0.0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            elapsed = perf_counter() - frame[1]
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed - frame[2]
+            if self._stack:
+                self._stack[-1][2] += elapsed
+
+    def record(self, status):
+        """
+        Returns:
+            dict: Fields of a file_timings row, durations in milliseconds. Stages the row did not go through are None.
+        """
+        fields = {f'{name}_ms': round(self.stages[name] * 1000, 3) if name in self.stages else None for name in STAGES}
+        return {
+            **fields,
+            'status': status,
+            'total_ms': round((perf_counter() - self.started) * 1000, 3),
+            'bytes_downloaded': self.bytes_downloaded,
+            'output_bytes': self.output_bytes
+        }
+
+
+def current():
+    """
+    Returns:
+        RowTimer: Timer of the row processed in this thread or task, None if the row is not sampled.
+    """
+    return _current.get()
+
+
+def activate(timer):
+    """Make timer the current one. Returns a token for deactivate.
+    """
+    return _current.set(timer)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+@contextmanager
+def stage(name):
+    """Time a stage of the current row, does nothing if it is not sampled.
+    """
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+
+    with timer.stage(name):
+        yield
+
+
+def note(**values):
+    """Set bytes_downloaded or output_bytes of the current row.
+    """
+    timer = _current.get()
+    if timer is not None:
+        for name, value in values.items():
+            setattr(timer, name, value)
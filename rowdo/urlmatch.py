@@ -0,0 +1,89 @@
+from urllib.parse import urlsplit, urlunsplit
+
+
+class UrlMatcher:
+    """Matches URLs against a list of allowed or disallowed URL prefixes and optional URL file formats.
+
+    A URL matches if it starts with one of the prefixes and, when formats are given, ends with `.format`.
+    `*` as a prefix matches every URL, `*` in formats disables the format check.
+
+    Prefixes and format suffixes are kept in hash sets grouped by length,
+    so a match costs one lookup per distinct length instead of one regex scan per (prefix, format) pair.
+    """
+    def __init__(self, prefixes, formats=None):
+        prefixes = [prefix for prefix in prefixes if prefix and not prefix.isspace()]
+        formats = [form for form in (formats or []) if form and not form.isspace()]
+
+        self.match_all = '*' in prefixes
+        self._prefixes = self._group_by_length(prefixes)
+        self._suffixes = None
+        if formats and '*' not in formats:
+            self._suffixes = self._group_by_length([f'.{form}' for form in formats])
+
+    @staticmethod
+    def _group_by_length(strings):
+        """
+        Returns:
+            list: (length, set of strings) pairs, shortest first.
+        """
+        groups = {}
+        for string in strings:
+            groups.setdefault(len(string), set()).add(string)
+
+        return sorted(groups.items())
+
+    def _shortest_prefix(self, url):
+        for length, prefixes in self._prefixes:
+            if length > len(url):
+                break
+            if url[:length] in prefixes:
+                return length
+
+        return None
+
+    def _shortest_suffix(self, url):
+        for length, suffixes in self._suffixes:
+            if length > len(url):
+                break
+            if url[-length:] in suffixes:
+                return length
+
+        return None
+
+    def match(self, url):
+        if self.match_all:
+            prefix_length = 0
+        else:
+            prefix_length = self._shortest_prefix(url)
+            if prefix_length is None:
+                return False
+
+        if self._suffixes is None:
+            return True
+
+        suffix_length = self._shortest_suffix(url)
+        if suffix_length is None:
+            return False
+
+        # Prefix and format may not overlap, like the former `^prefix(.*)\.format$` patterns.
+        return prefix_length + suffix_length <= len(url)
+
+
+def normalize_url(url):
+    """Canonical form of a URL for comparing downloads: scheme and host lowercased, default port and fragment dropped.
+    """
+    parts = urlsplit(url.strip())
+    try:
+        port = parts.port
+    except ValueError:  # Invalid port, compared as it is.
+        return url.strip()
+
+    netloc = parts.hostname or ''
+    if ':' in netloc:  # IPv6
+        netloc = f'[{netloc}]'
+    if port and (parts.scheme.lower(), port) not in (('http', 80), ('https', 443)):
+        netloc = f'{netloc}:{port}'
+    if parts.username:
+        netloc = f'{parts.username}:{parts.password}@{netloc}' if parts.password else f'{parts.username}@{netloc}'
+
+    return urlunsplit((parts.scheme.lower(), netloc, parts.path or '/', parts.query, ''))
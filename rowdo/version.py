@@ -1,2 +1,2 @@
 __version__ = "0.1.1"
-__schema_version__ = "0.1.0"
+__schema_version__ = "0.9.0"
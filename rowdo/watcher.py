@@ -1,18 +1,43 @@
 import re
 import os
-import io
-import math
-from time import sleep
+import random
+import hashlib
+import threading
+from uuid import uuid4
+from functools import partial
+from contextlib import contextmanager
+from types import SimpleNamespace
+from time import sleep, perf_counter, monotonic
+from datetime import timedelta
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+from concurrent.futures.process import BrokenProcessPool
 
 import requests
-from PIL import Image
+from requests.structures import CaseInsensitiveDict
 import filetype
 
 from rowdo.logging import logger, get_severity_name
 import rowdo.config as config
 import rowdo.database
 import rowdo.exceptions as exceptions
+import rowdo.cache
+import rowdo.http_session
+import rowdo.imaging
+import rowdo.metrics
+import rowdo.timing
+import rowdo.lease
+from rowdo.urlmatch import UrlMatcher, normalize_url
+from rowdo.resume import PartialDownload
+from rowdo.hosts import HostScheduler, BACKOFF_STATUSES, host_of
+
+
+WORKER_THREAD = 'thread'
+WORKER_PROCESS = 'process'
+
+MIME_SNIFF_BYTES = 8192  # Most bytes filetype reads to guess a type.
+
+_WORKER_WATCHER = None  # Watcher instance owned by a worker process.
 
 
 class ResizeException(Exception):
@@ -21,101 +46,568 @@ class ResizeException(Exception):
         self.message = args[0]
 
 
+def _process_worker_init(node_id):
+    """Create a private database connection and watcher inside a worker process.
+    Worker shares the parent's node id so it can renew the parent's claims.
+    Settings are the ones of the parent when the pool started, reloads do not reach worker processes.
+    """
+    global _WORKER_WATCHER
+    _WORKER_WATCHER = Watcher(rowdo.database.Database(cleanup=False, node_id=node_id))
+
+
+def _process_worker_run(row_ids, presets_version=None):
+    """
+    Returns:
+        tuple: Host backoffs started by the rows and metrics recorded by the worker, merged in the parent.
+    """
+    try:
+        _WORKER_WATCHER.db.refresh_presets(presets_version)
+        _WORKER_WATCHER.process_row_ids(row_ids)
+        return _WORKER_WATCHER.hosts.drain_backoffs(), rowdo.metrics.REGISTRY.drain()
+    finally:
+        _WORKER_WATCHER.db.flush_writes()  # Parent can not flush a worker process' writes.
+
+
+class SharedFetch:
+    """Body of a URL fetched once for every row of a group downloading it.
+    A request error is kept too, so the other rows fail the same way without asking again.
+    """
+    def __init__(self):
+        self.path = None
+        self.headers = None
+        self.error = None
+
+    def keep(self, temp_path, headers):
+        """Keep a link to the first row's downloaded file, which is moved away when that row is saved.
+        """
+        shared_path = f'{temp_path}.shared'
+        try:
+            rowdo.cache.link_or_copy(temp_path, shared_path)
+        except OSError as err:  # Other rows fetch for themselves.
+            logger.warning(f'Couldn\'t share fetched file {temp_path}. {err}')
+            return
+
+        self.path = shared_path
+        self.headers = headers
+
+    def close(self):
+        if self.path:
+            rowdo.cache.DownloadCache.remove_file(self.path)
+            self.path = None
+
+
+class BodyWriter:
+    """Writes a response body into an open file as its chunks arrive, hashing it into digest if given.
+
+    When check is given, the start of the body is held back until MIME_SNIFF_BYTES of it arrived or the body ended,
+    then passed to check before anything is written. Chunks can be as short as a few bytes, too few to sniff.
+    """
+    def __init__(self, body_file=None, digest=None, check=None):
+        self.path = None
+        self.body_file = body_file
+        self.digest = digest
+        self._check = check
+        self._head = b''
+
+    def open(self, path, body_file, sniff=True):
+        """Write into body_file at path, as returned by Watcher.open_temp_file. Without sniff the body is not checked.
+        """
+        self.path = path
+        self.body_file = body_file
+        if not sniff:
+            self._check = None
+
+    def close(self):
+        if self.body_file:
+            self.body_file.close()
+
+    def write(self, chunk):
+        if self._check:
+            self._head += chunk
+            if len(self._head) < MIME_SNIFF_BYTES:
+                return
+            chunk = self._checked_head()
+
+        self._write(chunk)
+
+    def finish(self):
+        """Check and write a held back start of a body shorter than MIME_SNIFF_BYTES, an empty body included.
+        """
+        if self._check:
+            self._write(self._checked_head())
+
+    def _checked_head(self):
+        head, self._head = self._head, b''
+        check, self._check = self._check, None
+        check(head)
+        return head
+
+    def _write(self, chunk):
+        self.body_file.write(chunk)
+        if self.digest:
+            self.digest.update(chunk)
+
+
+@contextmanager
+def keeping_error(shared):
+    """Keep a request error of the block in shared, so the other rows of the group fail the same way without asking again.
+    """
+    try:
+        yield
+    except exceptions.RequestError as exc:  # Failed for every row of the URL.
+        if shared:
+            shared.error = exc
+        raise
+
+
 class Watcher:
     def __init__(self, db: rowdo.database.Database):
         self.db = db
         self.keep_loop = True
+        self.http = None
+        self._shared_fetches = {}  # Normalized URL -> SharedFetch of the row group being processed.
+        self.hosts = HostScheduler()  # Kept across config reloads with its backoffs.
+
+        self.workers = max(config.get('runtime', 'workers'), 1)
+        self.worker_type = config.get('runtime', 'worker_type').lower()
+        if self.worker_type not in (WORKER_THREAD, WORKER_PROCESS):
+            raise ValueError(f'Invalid worker type: {self.worker_type}')
+        self._executor = None
+        self._queue_observed_at = None
+
+        self.image_processes = max(config.get('image', 'processes'), 0)
+        if self.image_processes and self.worker_type == WORKER_PROCESS:
+            logger.warning('Rows are already processed in worker processes, image processes setting is ignored.')
+            self.image_processes = 0
+        self._image_executor = None
+        self._image_executor_lock = threading.Lock()
 
+        self.configure()
+
+    def configure(self):
+        """Read settings which can change while running. Called again when config.ini is reloaded.
+        Worker pool and database settings apply on restart.
+        """
         allow_from = config.get('download', 'allow_from', return_type=list)
         disallow_from = config.get('download', 'disallow_from', return_type=list)
         allow_formats = config.get('download', 'allow_formats_url', return_type=list)
         allow_mimes = config.get('download', 'allow_mime_types', return_type=list)
 
-        self.allowed_urls_r = self.create_url_regexes(allow_from, allow_formats)
-        self.disallowed_urls_r = self.create_url_regexes(disallow_from)
+        self.allowed_urls = UrlMatcher(allow_from, allow_formats)
+        self.disallowed_urls = UrlMatcher(disallow_from)
         self.allowed_mime_types = allow_mimes
 
         self.download_path = config.get('download', 'path')
         Path(self.download_path).mkdir(parents=True, exist_ok=True)
 
         self.max_attempts = config.get('download', 'max_attempts')
+        self.attempt_delay = config.get('download', 'attempt_delay_seconds')
+        self.max_attempt_delay = config.get('download', 'max_attempt_delay_seconds')
+        self.attempt_delay_jitter = min(max(config.get('download', 'attempt_delay_jitter'), 0.0), 1.0)
 
         self.keep_relative_path = config.get('download', 'keep_relative_path')
+        self.chunk_size = config.get('download', 'chunk_size')
+        self.head_check = config.get('download', 'head_check')
+        self.resume_min_bytes = config.get('download', 'resume_min_bytes')
 
-    def create_url_regexes(self, urls, formats=None):
-        regexes = []
-        for url in urls:
-            if url.isspace() or url == '':
-                continue
+        self.resize_filter = config.get('image', 'resize_filter')
+        self.image_options = {
+            'reducing_gap': config.get('image', 'reducing_gap'),
+            'draft': config.get('image', 'draft'),
+            'quality': config.get('image', 'quality'),
+            'optimize': config.get('image', 'optimize'),
+            'progressive': config.get('image', 'progressive')
+        }
 
-            if url == '*':
-                regexes = [re.compile('(.*)')]
-                break
+        if self.http:
+            self.http.close()
+        self.http = rowdo.http_session.create_session()
 
-            if not formats or '*' in formats:
-                regexes.append(
-                    re.compile(
-                        f'^{url}(.*)$'
-                    )
-                )
-                continue
+        self.cache = None
+        if config.get('cache', 'enabled'):
+            self.cache = rowdo.cache.DownloadCache(
+                config.get('cache', 'path'),
+                max_bytes=config.get('cache', 'max_size_mb') * 1024 * 1024,
+                fresh_seconds=config.get('cache', 'fresh_seconds'),
+                hardlink=config.get('cache', 'hardlink')
+            )
 
-            for form in formats:
-                regexes.append(
-                    re.compile(
-                        f'^{url}(.*).{form}$'
-                    )
-                )
+        self.hosts.configure(
+            config.get('hosts', 'limits', return_type=list),
+            rate=config.get('hosts', 'rate_per_second'),
+            burst=config.get('hosts', 'burst'),
+            concurrency=config.get('hosts', 'concurrency'),
+            backoff_seconds=config.get('hosts', 'backoff_seconds'),
+            max_backoff_seconds=config.get('hosts', 'max_backoff_seconds')
+        )
+        self.host_max_wait = config.get('hosts', 'max_wait_seconds')
 
-        return regexes
+        self.batch_size = config.get('runtime', 'batch_size')
+        self.cursor_lag_seconds = config.get('runtime', 'cursor_lag_seconds')
+        self.priority_aging_seconds = config.get('runtime', 'priority_aging_seconds')
+        self.metrics_enabled = config.get('metrics', 'enabled')
+        self.queue_seconds = config.get('metrics', 'queue_seconds')
+        self.timing_sample = min(max(config.get('timings', 'sample_percent'), 0.0), 100.0) / 100
 
     def routine(self):
+        with rowdo.metrics.ROUTINE_SECONDS.time():
+            self.run_routine()
+
+    def run_routine(self):
         logger.debug('Running routine.')
+        self.observe_queue()
+        self.db.recover_stale_claims()
+        self.db.refresh_presets()
+        cursor, until = self.start_cursor()
+
+        while self.keep_loop:
+            rows, page_cursor = self.claim_rows(cursor, until)
+            if not page_cursor:
+                break
+
+            logger.debug(f'Claimed {len(rows)} rows.')
+            self.process_rows(rows)
+            cursor = page_cursor
+            self.finish_batch(cursor)
+
+        self.db.close_session()
+
+    def observe_queue(self):
+        """Update queue depth and poll lag metrics, only when they are served and at most every queue_seconds.
+        Counting scans the status index of the whole files table.
+        """
+        if not self.metrics_enabled:
+            return
+
+        now = monotonic()
+        if self._queue_observed_at is not None and now - self._queue_observed_at < self.queue_seconds:
+            return
+
+        self._queue_observed_at = now
+        counts, oldest = self.db.get_queue_stats()
+        for status, name in rowdo.database.STATUS_NAMES.items():
+            rowdo.metrics.QUEUE_ROWS.set(counts.get(status, 0), status=name)
+        rowdo.metrics.POLL_LAG.set(max((self.db.database_now() - oldest).total_seconds(), 0) if oldest else 0)
+
+    def process_rows(self, rows):
+        """Start row groups as the host scheduler allows, up to one per worker at a time.
+        Groups of hosts which can not start within max_wait_seconds are left for a later routine.
+        """
+        pending = self.hosts.interleave((self.group_host(group), group) for group in self.group_rows(rows))
+        if self.workers > 1:
+            self.db.close_session()  # Rows are reloaded in each worker's own session.
+
+        running = {}  # Future -> host
+        while pending or running:
+            pair, wait, blocked = self.next_group(pending, len(running), self.workers)
+            if pair:
+                if self.workers > 1:
+                    running[self.submit_group(pair[1])] = pair[0]
+                else:
+                    self.run_group(*pair)
+                continue
+
+            self.defer_rows(blocked)
+            if running:
+                done, _ = wait_futures(running, timeout=wait, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.group_done(running.pop(future), future.result())
+            elif pending:
+                sleep(wait or 0.1)
+
+        self.hosts.prune()
+
+    def next_group(self, pending, running, capacity):
+        """Scheduling step of process_rows and process_rows_async.
+
+        Args:
+            pending (list): (host, group) pairs not started yet, the returned ones are removed.
+            running (int): Groups running now.
+            capacity (int): Groups allowed to run at once.
+
+        Returns:
+            tuple: (host, group) pair to start now or None, seconds until the next one may start,
+                and pairs of hosts which can not start within max_wait_seconds, to be deferred.
+        """
+        if running >= capacity:
+            return None, None, []
+
+        pair, wait = self.hosts.take(pending)
+        if pair:
+            return pair, wait, []
+
+        return None, wait, self.hosts.pop_blocked(pending, self.host_max_wait)
+
+    def group_done(self, host, result=None):
+        self.hosts.release(host)
+        if result:  # Only process workers report back.
+            backoffs, metrics = result
+            self.hosts.merge_backoffs(backoffs)
+            rowdo.metrics.REGISTRY.merge(metrics)
+
+    def submit_group(self, group):
+        row_ids = [row.id for row in group]
+        if self.worker_type == WORKER_PROCESS:
+            return self.get_executor().submit(_process_worker_run, row_ids, self.db.presets_version)
+
+        return self.get_executor().submit(self.process_row_ids, row_ids)
+
+    def run_group(self, host, group):
+        try:
+            self.handle_row_group(group)
+        finally:
+            self.group_done(host)
+
+    @staticmethod
+    def group_host(group):
+        """
+        Returns:
+            str: Host the group downloads from, None for other commands.
+        """
+        row = group[0]
+        return host_of(row.url) if row.command == rowdo.database.COMMAND_DOWNLOAD else None
+
+    def defer_rows(self, pairs):
+        """Give rows of paused or rate limited hosts back to the queue without counting an attempt.
+        """
+        for _, group in pairs:
+            for row in group:
+                self.db.update_file_row(row, {
+                    'status': rowdo.database.STATUS_WAITING_TO_PROCESS,
+                    'claimed_by': None,
+                    'claim_expires_at': None
+                })
+
+        if pairs:
+            logger.debug(f'Deferred {sum(len(group) for _, group in pairs)} rows of paused or rate limited hosts.')
+
+    @staticmethod
+    def group_rows(rows):
+        """Group download rows of a batch by normalized URL, so each URL is fetched once. Other rows are left alone.
+
+        Returns:
+            list: Lists of rows, in the order of their first row.
+        """
+        groups = []
+        by_url = {}
+        for row in rows:
+            if row.command != rowdo.database.COMMAND_DOWNLOAD:
+                groups.append([row])
+                continue
+
+            url = normalize_url(row.url)
+            if url in by_url:
+                by_url[url].append(row)
+            else:
+                by_url[url] = [row]
+                groups.append(by_url[url])
+
+        return groups
+
+    def start_cursor(self):
+        """Starting point and end of this routine's scan over the files table.
+        Rows updated after the routine started, such as rows marked for retry, are left for the next routine.
+        The end lags behind the database clock by cursor_lag_seconds so rows of transactions committing late
+        are not passed by the cursor.
+
+        Returns:
+            tuple: (last_checked_timestamp, last_checked_id) cursor and the upper bound of updated_at.
+        """
         runtime = self.db.get_runtime()
 
-        last_checked_timestamp = None
+        cursor = (None, None)
         if runtime:
-            last_checked_timestamp = runtime.last_checked_timestamp
+            cursor = (runtime.last_checked_timestamp, runtime.last_checked_id)
 
-        rows = self.db.read_file_rows(
-            status=[rowdo.database.STATUS_WAITING_TO_PROCESS, rowdo.database.STATUS_WILL_RETRY],
-            last_checked_timestamp=last_checked_timestamp
+        until = (self.db.database_now() - timedelta(seconds=self.cursor_lag_seconds)).replace(microsecond=0)
+        return cursor, until
+
+    def claim_rows(self, cursor, until):
+        """Claim the next page of rows after the cursor, and rows above the default priority up to now.
+
+        Returns:
+            tuple: Claimed rows and the (updated_at, id) cursor after the page, cursor is None when the scan is complete.
+        """
+        last_checked_timestamp, after_id = cursor
+        return self.db.claim_file_rows(
+            status=[rowdo.database.STATUS_WAITING_TO_PROCESS],
+            last_checked_timestamp=last_checked_timestamp,
+            after_id=after_id,
+            until=until,
+            limit=self.batch_size,
+            priority_until=self.db.database_now() - timedelta(seconds=self.cursor_lag_seconds),
+            aging_seconds=self.priority_aging_seconds,
+            retry_status=[rowdo.database.STATUS_WILL_RETRY]
         )
 
-        logger.debug([row for row in rows])
-        for row in rows:
-            try:
-                self.process_row(row)
-            except exceptions.RowdoException as exc:
-                severity = exc.level if exc.level else 50
-                logger.log(get_severity_name(severity), exc)
-                self.db.register_error(row, exc)
-                if exc.level > exceptions.WARNING:
-                    # Mark file to prevent retry.
-                    self.db.update_file_row(row, {
-                        'status': rowdo.database.STATUS_ERROR,
-                        'failed_attempts': row.failed_attempts + 1
-                    })
-                elif row.failed_attempts >= self.max_attempts - 1:
-                    # Mark file multi tried error. It won't retry.
-                    logger.error(f'Max attempts reached. ID:{row.id}')
-                    self.db.update_file_row(row, {
-                        'status': rowdo.database.STATUS_MAX_RETRIES_REACHED,
-                        'failed_attempts': row.failed_attempts + 1
-                    })
-                else:
-                    # Mark file error but ok to retry.
-                    logger.debug(f'Mark for retry. ID:{row.id}')
-                    self.db.update_file_row(row, {
-                        'status': rowdo.database.STATUS_WILL_RETRY,
-                        'failed_attempts': row.failed_attempts + 1
-                    })
-        self.db.close_session()
+    def finish_batch(self, cursor):
+        """Move the runtime watermark after a page and write the pending changes.
 
-    def process_row(self, row):
-        self.db.update_file_row(row, {
-            "status": rowdo.database.STATUS_PROCESSING  # ! DEBUG ONLY rowdo.database.STATUS_PROCESSING
+        Args:
+            cursor (tuple): (updated_at, id) of the last scanned row.
+        """
+        self.db.set_runtime({
+            'last_checked_timestamp': cursor[0],
+            'last_checked_id': cursor[1]
         })
+        self.db.flush_writes()
+
+    def get_executor(self):
+        if not self._executor:
+            logger.debug(f'Starting {self.workers} {self.worker_type} workers.')
+            if self.worker_type == WORKER_PROCESS:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_process_worker_init, initargs=(self.db.node_id,))
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='rowdo-worker')
+
+        return self._executor
+
+    def process_row_ids(self, row_ids):
+        """Load a group of rows from process_rows in the current worker's session and process them.
+
+        Args:
+            row_ids (list): Files table ids.
+        """
+        try:
+            self.handle_row_group([row for row in map(self.db.get_file_row, row_ids) if row])
+        finally:
+            self.db.close_session()
+
+    def handle_row_group(self, rows):
+        """Process rows downloading the same URL one after another, sharing the body fetched by the first of them.
+        Every row keeps its own checks, status and error log.
+        """
+        if len(rows) == 1:
+            return self.handle_row(rows[0])
+
+        with self.sharing_fetch(rows):
+            for row in rows:
+                self.handle_row(row)
+
+    @contextmanager
+    def sharing_fetch(self, rows):
+        """Rows of a group fetch their URL through the same SharedFetch while the block runs.
+        """
+        url = normalize_url(rows[0].url)
+        shared = SharedFetch()
+        self._shared_fetches[url] = shared
+        try:
+            yield shared
+        finally:
+            del self._shared_fetches[url]
+            shared.close()
+
+    def process_row_id(self, row_id):
+        """Load a row in the current worker's session and process it.
+
+        Args:
+            row_id (int): Files table id.
+        """
+        try:
+            row = self.db.get_file_row(row_id)
+            if row:
+                self.handle_row(row)
+        finally:
+            self.db.close_session()
+
+    def handle_row(self, row):
+        """Process a row, recording its timing breakdown in file_timings if it is sampled.
+        Rows deleted by their command have nothing left to attach a breakdown to.
+        Its claim is kept while it is processed, see rowdo.lease.
+        """
+        timer = self.get_row_timer(row)
+        token = rowdo.timing.activate(timer)
+        lease_token = rowdo.lease.activate(rowdo.lease.ClaimLease(self.db, row))
+        try:
+            status = self.run_row(row)
+        finally:
+            rowdo.lease.deactivate(lease_token)
+            rowdo.timing.deactivate(token)
+
+        if timer and status is not None and row.command not in (rowdo.database.COMMAND_DELETE, rowdo.database.COMMAND_DELETE_ROW_ONLY):
+            self.db.record_file_timing(row, timer.record(status))
+
+    def get_row_timer(self, row):
+        """
+        Returns:
+            rowdo.timing.RowTimer: Timer of the row if it is in the sampled config.timings.sample_percent of rows, None otherwise.
+        """
+        if self.timing_sample and random.random() < self.timing_sample:
+            return rowdo.timing.RowTimer()
+
+        return None
+
+    def run_row(self, row):
+        """Process a row and keep its status and error log in order.
+
+        Returns:
+            int: Status the row is left in, None if its claim was lost.
+        """
+        command = rowdo.database.COMMAND_NAMES.get(row.command, str(row.command))
+        try:
+            processed = self.process_row(row)
+            rowdo.metrics.ROWS_PROCESSED.inc(command=command, status='done' if processed else 'claim_lost')
+            return rowdo.database.STATUS_DONE if processed else None
+        except exceptions.ClaimLostError as exc:
+            logger.warning(exc)
+            rowdo.metrics.ROWS_PROCESSED.inc(command=command, status='claim_lost')
+            return None
+        except exceptions.RowdoException as exc:
+            severity = exc.level if exc.level else 50
+            logger.log(get_severity_name(severity), exc)
+            self.db.register_error(row, exc)
+            if exc.level > exceptions.WARNING:
+                # Mark file to prevent retry.
+                self.discard_partial(row)
+                rowdo.metrics.ROWS_PROCESSED.inc(command=command, status='error')
+                self.db.update_file_row(row, {
+                    'status': rowdo.database.STATUS_ERROR,
+                    'failed_attempts': row.failed_attempts + 1
+                })
+                return rowdo.database.STATUS_ERROR
+            elif row.failed_attempts >= self.max_attempts - 1:
+                # Mark file multi tried error. It won't retry.
+                logger.error(f'Max attempts reached. ID:{row.id}')
+                self.discard_partial(row)
+                rowdo.metrics.ROWS_PROCESSED.inc(command=command, status='max_retries_reached')
+                self.db.update_file_row(row, {
+                    'status': rowdo.database.STATUS_MAX_RETRIES_REACHED,
+                    'failed_attempts': row.failed_attempts + 1
+                })
+                return rowdo.database.STATUS_MAX_RETRIES_REACHED
+            else:
+                # Mark file error but ok to retry.
+                delay = self.get_retry_delay(row, getattr(exc, 'retry_after', None))
+                logger.debug(f'Mark for retry in {delay:.1f} seconds. ID:{row.id}')
+                rowdo.metrics.ROWS_PROCESSED.inc(command=command, status='will_retry')
+                self.db.update_file_row(row, {
+                    'status': rowdo.database.STATUS_WILL_RETRY,
+                    'failed_attempts': row.failed_attempts + 1,
+                    'next_attempt_at': self.db.database_now() + timedelta(seconds=delay)
+                })
+                return rowdo.database.STATUS_WILL_RETRY
+
+    def get_retry_delay(self, row, retry_after=None):
+        """Seconds until the next attempt of a failed row, doubling with each failed attempt.
+        Jitter takes up to its fraction off, so rows failing together are not retried together.
+        A longer Retry-After of the server is kept, up to the maximum delay.
+        """
+        delay = min(self.attempt_delay * 2 ** row.failed_attempts, self.max_attempt_delay)
+        delay *= 1 - self.attempt_delay_jitter * random.random()
+        if retry_after:
+            delay = max(delay, min(retry_after, self.max_attempt_delay))
+
+        return delay
+
+    def discard_partial(self, row):
+        part = self.get_partial(row)
+        if part:
+            part.discard()
+
+    def process_row(self, row):
+        if not self.db.renew_claim(row):
+            logger.warning(f'Claim lost, skipping. ID:{row.id}')
+            return False
 
         if row.command == rowdo.database.COMMAND_DOWNLOAD:
             downloaded_info = self.download_file(row)
@@ -125,10 +617,19 @@ class Watcher:
                     "downloaded_path": downloaded_info['relative_path'] if self.keep_relative_path else downloaded_info['full_path'],
                     "filename": downloaded_info['filename']
                 })
+                rowdo.timing.note(output_bytes=self.get_output_bytes(downloaded_info))
+                if downloaded_info['variants']:
+                    self.db.set_file_variants(row, [{
+                        "width": variant['size'][0],
+                        "height": variant['size'][1],
+                        "size": variant['bytes'],
+                        "downloaded_path": variant['relative_path'] if self.keep_relative_path else variant['full_path']
+                    } for variant in downloaded_info['variants']])
         elif row.command == rowdo.database.COMMAND_DELETE_ROW_ONLY:
             self.db.delete_file_row(row)
         elif row.command == rowdo.database.COMMAND_DELETE_FILE_ONLY:
             self.delete_file(row)
+            self.db.set_file_variants(row, [])
             self.db.update_file_row(row, {
                 "status": rowdo.database.STATUS_DONE,
                 "downloaded_path": None,
@@ -142,30 +643,41 @@ class Watcher:
                 "status": rowdo.database.STATUS_DONE
             })
 
-        self.db.set_runtime({
-            'last_checked_timestamp': row.updated_at.isoformat()
-        })
+        return True
 
-    def url_check(self, url):
-        for rx in self.disallowed_urls_r:
-            if re.search(rx, url):
-                return False
+    @staticmethod
+    def get_output_bytes(downloaded_info):
+        """Size of a stored file with its variants, only read for rows with a timer.
+        """
+        if not rowdo.timing.current():
+            return None
+
+        return os.path.getsize(downloaded_info['full_path']) + sum(variant['bytes'] for variant in downloaded_info['variants'])
 
-        for rx in self.allowed_urls_r:
-            if re.search(rx, url):
-                return True
+    def url_check(self, url):
+        if self.disallowed_urls.match(url):
+            return False
 
-        return False  # Not allowed, not disallowed
+        return self.allowed_urls.match(url)  # Not allowed, not disallowed is False
 
-    def do_request(self, row):
+    def do_request(self, row, headers=None):
+        req = None
         try:
-            req = requests.get(row.url, allow_redirects=True)
+            req = self.http.get(row.url, headers=headers, allow_redirects=True, stream=True)
+            if req.status_code in BACKOFF_STATUSES:
+                self.hosts.backoff(row.url, rowdo.http_session.parse_retry_after(req.headers.get('Retry-After')))
             req.raise_for_status()
+            self.hosts.succeeded(row.url)
             if not req:
                 raise exceptions.RequestError('Empty Response.', level=exceptions.WARNING)
             return req
         except requests.exceptions.HTTPError:
-            raise exceptions.RequestError('HTTP returned non 200 code. Make sure url is correct.', level=exceptions.WARNING)
+            req.close()
+            raise exceptions.RequestError(
+                'HTTP returned non 200 code. Make sure url is correct.',
+                level=exceptions.WARNING,
+                retry_after=rowdo.http_session.parse_retry_after(req.headers.get('Retry-After'))
+            )
         except requests.exceptions.RequestException:
             raise exceptions.RequestError('Request Exception. Make sure URL is correct.', level=exceptions.WARNING)
 
@@ -198,69 +710,491 @@ class Watcher:
             return
 
         full_path = self.get_download_path(filename)
+        paths = [full_path] + [self.get_variant_path(full_path, variant.width) for variant in self.db.get_file_variants(row)]
 
-        if os.path.exists(full_path):
-            os.remove(full_path)
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
 
-    def download_file(self, row):  # noqa: C901
+    def download_file(self, row):
+        fetched = self.fetch_file(row)
+        if not fetched:
+            return
+
+        return self.store_file(row, fetched)
+
+    def fetch_file(self, row):
+        """Download row's URL into a temporary file. Rows of a group share the first body fetched for their URL.
+
+        Returns:
+            dict: Temporary path, filename, final path and kept response headers of the download.
+        """
+        shared = self.get_shared_fetch(row)
+        if shared and shared.path:
+            return self.fetch_shared(row, shared)
+
+        with keeping_error(shared):
+            fetched = self.request_file(row)
+
+        if shared and fetched:
+            shared.keep(fetched['temp_path'], fetched['headers'])
+
+        return fetched
+
+    def get_shared_fetch(self, row):
+        """Checks of a row before its URL is fetched, by either engine.
+        Raises for disallowed URLs, and with the error of an earlier row of the group downloading the same URL.
+
+        Returns:
+            SharedFetch: Of the row's group, None for rows fetched alone.
+        """
         if not self.url_check(row.url):
             raise exceptions.BlackListException(f'Disallowed URL or URL file format.: {row.url}', level=exceptions.ERROR)
 
-        if not self.is_downloadable(row.url):
-            raise exceptions.BlackListException(f'URL is not downloadable type.: {row.url}', level=exceptions.ERROR)
+        shared = self._shared_fetches.get(normalize_url(row.url))
+        if shared and shared.error:
+            raise shared.error
+
+        return shared
+
+    def fetch_shared(self, row, shared):
+        logger.debug(f'Sharing fetched body of {row.url}. ID:{row.id}')
+        return self.fetch_copy(row, shared.headers, partial(rowdo.cache.link_or_copy, shared.path))
+
+    def request_file(self, row):
+        """Download row's URL into a temporary file. With the download cache enabled, duplicates are served from disk
+        and cached URLs are revalidated with a conditional request.
 
-        req = self.do_request(row)  # Can throw error.
+        Returns:
+            dict: Temporary path, filename, final path and kept response headers of the download.
+        """
+        plan = self.plan_request(row)
+        if plan.fresh:
+            return self.fetch_from_cache(row, plan.entry)
+
+        if self.head_check:
+            self.check_downloadable(row, self.head_content_type(row.url))
+
+        started = perf_counter()
+        with rowdo.timing.stage('request'):
+            req = self.do_request(row, headers=plan.headers)  # Can throw error.
+
+        try:
+            fetched, streamed = self.read_response(plan, req, req.status_code)
+            if not streamed:
+                return fetched
 
-        if '*' not in self.allowed_mime_types:
-            h_content_type = req.headers.get('Content-Type', False)
-            if h_content_type and h_content_type not in self.allowed_mime_types and False:
-                raise exceptions.BlackListException(f'URL is not downloadable mime type (found {h_content_type}).: {row.url}', level=exceptions.ERROR)
+            with rowdo.timing.stage('download'):
+                fetched['temp_path'] = self.stream_to_file(req, os.path.dirname(fetched['full_path']), row.url, plan.digest, plan.part)
+        finally:
+            req.close()
+
+        return self.finish_fetch(plan, fetched, req.headers, started)
+
+    def plan_request(self, row):
+        """Start of a download by either engine, before any request: a fresh cached body is served from disk,
+        otherwise a kept partial download is resumed with a Range request, or a cached one revalidated.
+
+        Returns:
+            SimpleNamespace: row, cache entry, whether it is fresh, partial download, request headers and body digest.
+        """
+        entry = self.cache.lookup(row.url) if self.cache else None
+        if entry and self.cache.is_fresh(entry):
+            return SimpleNamespace(row=row, entry=entry, fresh=True)
+
+        part = self.get_partial(row)
+        if part and part.load():
+            headers = part.range_headers()
+        else:
+            headers = rowdo.cache.DownloadCache.conditional_headers(entry)
+
+        return SimpleNamespace(row=row, entry=entry, fresh=False, part=part, headers=headers, digest=hashlib.sha256() if self.cache else None)
+
+    def read_response(self, plan, req, status):
+        """Handle a response of plan_request's request before its body is read. Not modified serves the cached body,
+        other responses are validated and their target directory is created.
+
+        Returns:
+            tuple: Fetched file info, None without a filename, and whether the response body has to be streamed into it.
+        """
+        if plan.entry and status == 304:
+            return self.fetch_from_cache(plan.row, self.cache.revalidated(plan.row.url, plan.entry, req.headers)), False
+
+        fetched = self.prepare_fetch(plan.row, req)
+        return fetched, fetched is not None
+
+    def finish_fetch(self, plan, fetched, headers, started):
+        """Record a streamed body and add it to the download cache.
+
+        Returns:
+            dict: fetched, with the kept response headers.
+        """
+        self.observe_download(plan.row.url, started, fetched['temp_path'], plan.part)
+        if self.cache:
+            self.cache_file(plan.row.url, fetched['temp_path'], plan.digest.hexdigest(), headers)
+
+        fetched['headers'] = self.kept_headers(headers)
+        return fetched
+
+    @staticmethod
+    def observe_download(url, started, temp_path, part=None):
+        host = host_of(url)
+        downloaded = os.path.getsize(temp_path) - (part.size if part else 0)
+        rowdo.metrics.DOWNLOAD_SECONDS.observe(perf_counter() - started, host=host)
+        rowdo.metrics.DOWNLOAD_BYTES.inc(downloaded, host=host)
+        rowdo.timing.note(bytes_downloaded=downloaded)
+
+    @staticmethod
+    def kept_headers(headers):
+        return {name: headers[name] for name in rowdo.cache.KEPT_HEADERS if headers.get(name)}
 
-            content_type = filetype.guess_mime(req.content)
-            if content_type not in self.allowed_mime_types:
-                raise exceptions.BlackListException(f'Downloaded bytes is not whitelisted mime type (found {content_type}).: {row.url}', level=exceptions.ERROR)
+    def fetch_from_cache(self, row, entry):
+        logger.debug(f'Serving from download cache: {row.url}')
+        return self.fetch_copy(row, entry['headers'], partial(self.cache.materialize, entry))
+
+    def fetch_copy(self, row, headers, copy_to):
+        """Fetch a row from a body already on disk into a temporary file, checked the same way as a response.
+
+        Args:
+            headers (dict): Kept response headers of the body.
+            copy_to (callable): Creates the given temporary path with the body.
+        """
+        stored = SimpleNamespace(headers=CaseInsensitiveDict(headers))
+        fetched = self.prepare_fetch(row, stored)
+        if not fetched:
+            return
+
+        temp_path = self.get_temp_path(os.path.dirname(fetched['full_path']))
+        try:
+            with rowdo.timing.stage('copy'):
+                rowdo.lease.keep()
+                copy_to(temp_path)
+                with open(temp_path, 'rb') as temp_file:
+                    self.check_mime_type(stored, temp_file.read(MIME_SNIFF_BYTES), row.url)
+        except OSError as err:
+            rowdo.cache.DownloadCache.remove_file(temp_path)
+            raise exceptions.FileAccessError(f'Couldn\'t copy stored body of {row.url}. {err}', level=exceptions.ERROR)
+        except BaseException:
+            rowdo.cache.DownloadCache.remove_file(temp_path)
+            raise
+
+        fetched['temp_path'] = temp_path
+        fetched['headers'] = headers
+        return fetched
+
+    def cache_file(self, url, temp_path, digest, headers):
+        """Add a download to the cache. Failures only cost the cache entry, the download goes on.
+        """
+        try:
+            self.cache.store(url, temp_path, digest, headers)
+        except OSError as err:
+            logger.warning(f'Couldn\'t add {url} to download cache. {err}')
+
+    def prepare_fetch(self, row, req):
+        """Validate response headers and create the target directory before the body is read.
+        """
+        self.check_downloadable(row, req.headers.get('content-type'))  # Body is not read, closing the stream aborts the transfer.
 
         filename = self.get_filename(row, req)
         if not filename:
             return
 
+        output_format = self.get_profile(row).output_format
+        if output_format:
+            filename = f'{os.path.splitext(filename)[0]}.{output_format.lower()}'
+
         full_path = self.get_download_path(filename)
         path_dirname = os.path.dirname(full_path)
 
-        try:
-            if row.resize_mode == rowdo.database.RESIZE_NONE:
-                file_to_save = req.content
-            elif row.resize_mode == rowdo.database.RESIZE_PASSTHROUGH:
-                file_to_save = self.resize_image(req.content, 'RATIO', 1)
-            elif row.resize_mode == rowdo.database.RESIZE_RATIO:
-                file_to_save = self.resize_image(req.content, 'RATIO', row.resize_ratio)
-            elif row.resize_mode == rowdo.database.RESIZE_DIMENSIONS:
-                file_to_save = self.resize_image(req.content, 'DIMENSIONS', row.resize_width, row.resize_height)
-            else:
-                raise exceptions.ResizeModeException('Invalid resize mode.', level=exceptions.ERROR)
-        except exceptions.ResizeException as exc:
-            raise exceptions.ResizeException(f'Resize algorithm failed: {exc.message}', level=exceptions.ERROR)
-
         try:
             if not os.path.exists(path_dirname):
                 logger.debug(f'Creating new directory: {path_dirname}')
-                os.makedirs(path_dirname)  # Create nested folders.
-
-            if getattr(file_to_save, 'save', False):
-                logger.trace(f'Saving using PIL: {full_path}')
-                file_to_save.save(full_path)  # PIL
-            else:
-                logger.trace(f'Saving file directly: {full_path}')
-                open(full_path, 'wb').write(file_to_save)
-        except (OSError, ValueError) as err:
+                os.makedirs(path_dirname, exist_ok=True)  # Create nested folders.
+        except OSError as err:
             raise exceptions.FileAccessError(f'Couldn\'t open the path {full_path}. {err}', level=exceptions.ERROR)
 
         return {
             "filename": filename,
-            "full_path": full_path,
-            "relative_path": f"{self.download_path}/{filename}"
+            "full_path": full_path
+        }
+
+    def store_file(self, row, fetched):
+        """Move a fetched file to its final path, resizing if row asks for it.
+
+        Returns:
+            dict: Filename, full path and relative path of the stored file, and its saved variants.
+        """
+        temp_path = fetched['temp_path']
+        try:
+            with rowdo.timing.stage('write'):
+                variants = self.save_file(row, temp_path, fetched['full_path'])
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        relative_path = f"{self.download_path}/{fetched['filename']}"
+        for variant in variants:
+            variant['relative_path'] = self.get_variant_path(relative_path, variant['size'][0])
+
+        return {
+            "filename": fetched['filename'],
+            "full_path": fetched['full_path'],
+            "relative_path": relative_path,
+            "variants": variants
         }
 
+    def check_mime_type(self, req, first_chunk, url):
+        if '*' in self.allowed_mime_types:
+            return
+
+        h_content_type = req.headers.get('Content-Type', False)
+        if h_content_type and h_content_type not in self.allowed_mime_types and False:
+            raise exceptions.BlackListException(f'URL is not downloadable mime type (found {h_content_type}).: {url}', level=exceptions.ERROR)
+
+        with rowdo.timing.stage('mime'):
+            content_type = filetype.guess_mime(first_chunk)
+        if content_type not in self.allowed_mime_types:
+            raise exceptions.BlackListException(f'Downloaded bytes is not whitelisted mime type (found {content_type}).: {url}', level=exceptions.ERROR)
+
+    def stream_to_file(self, req, path_dirname, url, digest=None, part=None):
+        """Stream response body into a temporary file next to its final location, or into the row's partial download.
+        MIME type is sniffed from the start of the body, so disallowed content is aborted early.
+        Body is hashed on the way into digest, if given.
+
+        Returns:
+            str: Path of the temporary file.
+        """
+        with self.receiving_body(req, path_dirname, url, digest, part, requests.exceptions.RequestException) as body:
+            body.open(*self.open_temp_file(req, req.status_code, path_dirname, url, digest, part))
+            for chunk in req.iter_content(chunk_size=self.chunk_size):
+                rowdo.lease.keep()
+                body.write(chunk)
+
+        return body.path
+
+    @contextmanager
+    def receiving_body(self, req, path_dirname, url, digest, part, request_errors):
+        """Receive a response body in the block of stream_to_file or stream_to_file_async, which opens the yielded
+        BodyWriter with open_temp_file and writes the chunks to it. A failed body is discarded, a partial download
+        is kept to be resumed if it is large enough.
+
+        Args:
+            request_errors (tuple): Exceptions of the HTTP client reading the body, raised as RequestError.
+        """
+        body = BodyWriter(digest=digest, check=lambda head: self.check_mime_type(req, head, url))
+        try:
+            try:
+                yield body
+                body.finish()
+            finally:
+                body.close()
+        except request_errors:
+            self.discard_temp_file(body.path, part)
+            raise exceptions.RequestError('Request Exception while reading response. Make sure URL is correct.', level=exceptions.WARNING)
+        except OSError as err:
+            self.discard_temp_file(body.path, part)
+            raise exceptions.FileAccessError(f'Couldn\'t write temporary file in {path_dirname}. {err}', level=exceptions.ERROR)
+        except BaseException:
+            self.discard_temp_file(body.path, part)
+            raise
+
+        if part:
+            part.finish()
+
+    def open_temp_file(self, req, status, path_dirname, url, digest, part):
+        """Open the file a response body is written to. A resumed partial download is opened for appending,
+        its kept bytes are checked and hashed first.
+
+        Returns:
+            tuple: Path, open file and whether the start of the response body still needs the MIME type check.
+        """
+        if not part:
+            temp_path = self.get_temp_path(path_dirname)
+            return temp_path, open(temp_path, 'xb'), True
+
+        if not part.begin(status, req.headers):
+            return part.path, open(part.path, 'ab'), True
+
+        with open(part.path, 'rb') as part_file:
+            head = part_file.read(MIME_SNIFF_BYTES)
+            self.check_mime_type(req, head, url)
+            if digest:
+                digest.update(head)
+                for block in iter(partial(part_file.read, self.chunk_size), b''):
+                    rowdo.lease.keep()
+                    digest.update(block)
+
+        return part.path, open(part.path, 'ab'), False
+
+    def discard_temp_file(self, temp_path, part):
+        """Remove the body of a failed download, a partial download is kept to be resumed if it is large enough.
+        """
+        if part:
+            part.keep_or_discard(self.resume_min_bytes)
+        elif temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    def get_partial(self, row):
+        """
+        Returns:
+            PartialDownload: Resumable download of the row, None if resuming is disabled.
+        """
+        if not self.resume_min_bytes:
+            return None
+
+        return PartialDownload(self.get_download_path(''), row.id, row.url)
+
+    def get_profile(self, row):
+        """Resize and output settings of a row. Rows with a preset_id use the preset's settings instead of their own.
+        A preset with an output format and no resize mode converts the image without resizing it.
+
+        Returns:
+            SimpleNamespace: resize_mode, resize_width, resize_height, resize_ratio, resize_filter, resize_variants, output_format and quality.
+        """
+        if row.preset_id is None:
+            return SimpleNamespace(
+                resize_mode=row.resize_mode,
+                resize_width=row.resize_width,
+                resize_height=row.resize_height,
+                resize_ratio=row.resize_ratio,
+                resize_filter=row.resize_filter,
+                resize_variants=row.resize_variants,
+                output_format=None,
+                quality=None
+            )
+
+        preset = self.db.get_preset(row.preset_id)
+        if not preset:
+            # Preset may be inserted after its rows, retry.
+            raise exceptions.PresetError(f'Preset not found: {row.preset_id}', level=exceptions.WARNING)
+
+        if preset.output_format and preset.resize_mode == rowdo.database.RESIZE_NONE:
+            return SimpleNamespace(**{**vars(preset), 'resize_mode': rowdo.database.RESIZE_PASSTHROUGH})
+
+        return preset
+
+    def save_file(self, row, temp_path, full_path):
+        """Move downloaded file to its final path, resizing on the way if row asks for it, and render its variants.
+        Files are always renamed in place atomically, readers never see a partial file.
+
+        Returns:
+            list: Full path, pixel size and file size in bytes of each saved variant.
+        """
+        profile = self.get_profile(row)
+        if profile.resize_mode == rowdo.database.RESIZE_NONE:
+            resize = (None, ())
+        elif profile.resize_mode == rowdo.database.RESIZE_PASSTHROUGH:
+            resize = (rowdo.imaging.MODE_RATIO, (1,))
+        elif profile.resize_mode == rowdo.database.RESIZE_RATIO:
+            resize = (rowdo.imaging.MODE_RATIO, (profile.resize_ratio,))
+        elif profile.resize_mode == rowdo.database.RESIZE_DIMENSIONS:
+            resize = (rowdo.imaging.MODE_DIMENSIONS, (profile.resize_width, profile.resize_height))
+        else:
+            raise exceptions.ResizeModeException('Invalid resize mode.', level=exceptions.ERROR)
+
+        path_dirname = os.path.dirname(full_path)
+        resized_path = self.get_temp_path(path_dirname)
+        variants = [(self.get_temp_path(path_dirname), width) for width in self.get_variant_widths(profile)]
+        try:
+            rendered, rendered_variants = (None, [])
+            if resize[0] or variants:
+                rendered, rendered_variants = self.render_image(profile, temp_path, resized_path, full_path, *resize, variants)
+                rowdo.lease.keep()  # Renders of large images can take a while.
+
+            saved_variants = []
+            for (variant_temp_path, width), variant in zip(sorted(variants, key=lambda v: v[1], reverse=True), rendered_variants):
+                variant_path = self.get_variant_path(full_path, width)
+                os.replace(variant_temp_path, variant_path)
+                saved_variants.append({**variant, 'full_path': variant_path})
+
+            if rendered:
+                logger.trace(f'Saving using PIL: {full_path} {rendered["size"]} {rendered["bytes"]} bytes')
+                os.replace(rendered['path'], full_path)
+            else:
+                logger.trace(f'Saving file directly: {full_path}')
+                os.replace(temp_path, full_path)
+        except (OSError, ValueError, KeyError) as err:
+            raise exceptions.FileAccessError(f'Couldn\'t open the path {full_path}. {err}', level=exceptions.ERROR)
+        finally:
+            for path in [resized_path] + [variant_temp_path for variant_temp_path, _ in variants]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+        return saved_variants
+
+    @staticmethod
+    def get_variant_widths(profile):
+        """Widths of the additional outputs of a row or preset, from its comma separated resize_variants.
+        """
+        widths = []
+        for width in filter(None, config.to_list(profile.resize_variants or '')):
+            try:
+                widths.append(int(width))
+            except ValueError:
+                raise exceptions.ResizeException(f'Resize variant width is not valid: {width}', level=exceptions.ERROR)
+
+            if widths[-1] <= 0:
+                raise exceptions.ResizeException(f'Resize variant width is not valid: {width}', level=exceptions.ERROR)
+
+        return widths
+
+    @staticmethod
+    def get_variant_path(full_path, width):
+        root, extension = os.path.splitext(full_path)
+        return f'{root}_{width}w{extension}'
+
+    def render_image(self, profile, temp_path, resized_path, full_path, mode, args, variants):
+        """Resize downloaded image into resized_path and its variants with a single decode,
+        using the profile's filter and quality, and configured encoder settings.
+        Runs in the image process pool when config.image.processes is set.
+
+        Returns:
+            tuple: Main output and variant outputs from rowdo.imaging.render, variants are ordered by descending width.
+                Main output is None if the image is already in the target size and format, temp_path can be saved as is.
+        """
+        render_args = (temp_path, resized_path, rowdo.imaging.image_format(full_path), mode, args, variants)
+        render_kwargs = {'resample': profile.resize_filter or self.resize_filter, **self.image_options}
+        if profile.quality:
+            render_kwargs['quality'] = profile.quality
+        try:
+            rowdo.lease.keep()
+            with rowdo.metrics.RESIZE_SECONDS.time(mode=(mode or 'variants').lower()), rowdo.timing.stage('resize'):
+                executor = self.get_image_executor()
+                if not executor:
+                    return rowdo.imaging.render(*render_args, **render_kwargs)
+
+                return executor.submit(rowdo.imaging.render, *render_args, **render_kwargs).result()
+        except exceptions.ResizeException as exc:
+            raise exceptions.ResizeException(f'Resize algorithm failed: {exc.message}', level=exceptions.ERROR)
+        except BrokenProcessPool:
+            self.shutdown_image_workers()  # Recreated on the next render.
+            raise exceptions.ResizeException('Image worker process died.', level=exceptions.WARNING)
+
+    def get_image_executor(self):
+        """Process pool for resizing and encoding images, None if images are rendered in the row's own worker.
+        """
+        if not self.image_processes:
+            return None
+
+        with self._image_executor_lock:
+            if not self._image_executor:
+                logger.debug(f'Starting {self.image_processes} image worker processes.')
+                self._image_executor = ProcessPoolExecutor(max_workers=self.image_processes)
+
+        return self._image_executor
+
+    def shutdown_image_workers(self):
+        with self._image_executor_lock:
+            if self._image_executor:
+                self._image_executor.shutdown(wait=True)
+                self._image_executor = None
+
+    @staticmethod
+    def get_temp_path(path_dirname):
+        """Unique hidden file in the target directory, so the final rename stays on the same filesystem.
+        """
+        return os.path.join(path_dirname, f'.rowdo-{uuid4().hex}.part')
+
     def get_download_path(self, filename):
         if ':' in self.download_path or '~' in self.download_path:
             full_path = os.path.join(self.download_path, filename)
@@ -269,14 +1203,29 @@ class Watcher:
 
         return full_path
 
+    def head_content_type(self, url):
+        """
+        Content type of the url, asked with a separate HEAD request
+        """
+        try:
+            with rowdo.timing.stage('head'):
+                h = self.http.head(url, allow_redirects=True)
+        except requests.exceptions.RequestException:
+            raise exceptions.RequestError('HEAD Request Exception. Make sure URL is correct.', level=exceptions.WARNING)
+
+        return h.headers.get('content-type')
+
+    def check_downloadable(self, row, content_type):
+        if not self.is_downloadable_type(content_type):
+            raise exceptions.BlackListException(f'URL is not downloadable type.: {row.url}', level=exceptions.ERROR)
+
     @staticmethod
-    def is_downloadable(url):
+    def is_downloadable_type(content_type):
         """
-        Does the url contain a downloadable resource
+        Is the content type a downloadable resource
         """
-        h = requests.head(url, allow_redirects=True)
-        header = h.headers
-        content_type = header.get('content-type')
+        if not content_type:
+            return True
         if 'text' in content_type.lower():
             return False
         if 'html' in content_type.lower():
@@ -295,40 +1244,25 @@ class Watcher:
             return default
         return file_name[0]
 
-    @staticmethod
-    def resize_image(image_bytes, mode, *args):
-        img = Image.open(io.BytesIO(image_bytes))
-        logger.trace(f'Resize Image, Mode:{mode} Args: {args}')
-        if mode == 'RATIO':
-            if len(args) < 1 or not args[0]:  # In case it is None or zero.
-                raise exceptions.ResizeException('Resize ratio was missing.', exceptions.ERROR)
-
-            try:
-                resize_ratio = float(args[0])
-            except TypeError as err:  # Invalid row.resize_ratio
-                raise exceptions.ResizeException(f"Resize ratio is not valid. {err}", exceptions.ERROR)
-
-            width = math.ceil(img.width * resize_ratio)
-            height = math.ceil(img.height * resize_ratio)
-            img = img.resize((width, height))
-
-        if mode == 'DIMENSIONS':
-            if len(args) < 2:
-                raise exceptions.ResizeException('Resize width or height was missing.', exceptions.ERROR)
-
-            if not (args[0] and args[1]):
-                raise exceptions.ResizeException('Resize width or height is zero.', exceptions.ERROR)
-
-            img = img.resize((args[0], args[1]))
-
-        return img
+    def refresh_config(self):
+        if config.refresh():
+            self.configure()
 
     def loop(self):
-        run_every_seconds = int(config.get('runtime', 'run_every_seconds'))
         while self.keep_loop:
+            self.refresh_config()
             self.routine()
-            for i in range(run_every_seconds * 10):
+            for i in range(config.get('runtime', 'run_every_seconds') * 10):
                 sleep(0.1)
 
+        self.shutdown_workers()
+        self.http.close()
+
+    def shutdown_workers(self):
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.shutdown_image_workers()
+
     def stop(self):
         self.keep_loop = False
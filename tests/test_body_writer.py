@@ -0,0 +1,125 @@
+import io
+import asyncio
+import hashlib
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+import rowdo.exceptions as exceptions
+from rowdo.watcher import Watcher, BodyWriter, MIME_SNIFF_BYTES
+from rowdo.aio import AsyncWatcher
+
+
+def png_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), 'red').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+PNG = png_bytes()
+SPLIT_CHUNKS = [PNG[:3], PNG[3:]]  # A server flushing 3 bytes first, as aiohttp hands them over.
+
+
+def create_watcher(cls, allowed_mime_types):
+    watcher = cls.__new__(cls)
+    watcher.allowed_mime_types = allowed_mime_types
+    watcher.chunk_size = 65536
+    watcher.resume_min_bytes = 0
+    return watcher
+
+
+def sync_response(chunks):
+    return SimpleNamespace(status_code=200, headers={'Content-Type': 'image/png'}, iter_content=lambda chunk_size: iter(chunks))
+
+
+def async_response(chunks):
+    async def iter_chunked(size):
+        for chunk in chunks:
+            yield chunk
+
+    return SimpleNamespace(status=200, headers={'Content-Type': 'image/png'}, content=SimpleNamespace(iter_chunked=iter_chunked))
+
+
+def test_head_is_checked_once_whole():
+    checked = []
+    body_file = io.BytesIO()
+    digest = hashlib.sha256()
+    body = BodyWriter(body_file, digest, checked.append)
+    for chunk in SPLIT_CHUNKS:
+        body.write(chunk)
+    body.finish()
+
+    assert checked == [PNG]
+    assert body_file.getvalue() == PNG
+    assert digest.hexdigest() == hashlib.sha256(PNG).hexdigest()
+
+
+def test_head_is_checked_before_the_rest_is_written():
+    checked = []
+    body_file = io.BytesIO()
+    body = BodyWriter(body_file, check=checked.append)
+    data = bytes(range(256)) * (MIME_SNIFF_BYTES // 256 * 3)
+    body.write(data[:10])
+    assert body_file.getvalue() == b'' and checked == []
+
+    body.write(data[10:])
+    body.finish()
+    assert checked == [data]
+    assert body_file.getvalue() == data
+
+
+def test_empty_body_is_checked():
+    checked = []
+    body = BodyWriter(io.BytesIO(), check=checked.append)
+    body.finish()
+    assert checked == [b'']
+
+
+def test_failed_check_writes_nothing():
+    def reject(head):
+        raise exceptions.BlackListException('rejected', level=exceptions.ERROR)
+
+    body_file = io.BytesIO()
+    body = BodyWriter(body_file, check=reject)
+    body.write(PNG[:3])
+    with pytest.raises(exceptions.BlackListException):
+        body.finish()
+    assert body_file.getvalue() == b''
+
+
+def test_without_check_chunks_are_written_as_they_come():
+    body_file = io.BytesIO()
+    body = BodyWriter(body_file)
+    body.write(b'abc')
+    assert body_file.getvalue() == b'abc'
+
+
+@pytest.mark.parametrize('chunks', [SPLIT_CHUNKS, [PNG], [bytes([byte]) for byte in PNG]])
+def test_stream_to_file_sniffs_split_chunks(tmp_path, chunks):
+    watcher = create_watcher(Watcher, ['image/png', 'image/jpeg'])
+    temp_path = watcher.stream_to_file(sync_response(chunks), str(tmp_path), 'http://example.com/a.png')
+    with open(temp_path, 'rb') as temp_file:
+        assert temp_file.read() == PNG
+
+
+@pytest.mark.parametrize('chunks', [SPLIT_CHUNKS, [PNG], [bytes([byte]) for byte in PNG]])
+def test_stream_to_file_async_sniffs_split_chunks(tmp_path, chunks):
+    watcher = create_watcher(AsyncWatcher, ['image/png', 'image/jpeg'])
+    temp_path = asyncio.run(watcher.stream_to_file_async(async_response(chunks), str(tmp_path), 'http://example.com/a.png'))
+    with open(temp_path, 'rb') as temp_file:
+        assert temp_file.read() == PNG
+
+
+def test_stream_to_file_rejects_other_types(tmp_path):
+    watcher = create_watcher(Watcher, ['image/jpeg'])
+    with pytest.raises(exceptions.BlackListException):
+        watcher.stream_to_file(sync_response(SPLIT_CHUNKS), str(tmp_path), 'http://example.com/a.png')
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_stream_to_file_async_rejects_other_types(tmp_path):
+    watcher = create_watcher(AsyncWatcher, ['image/jpeg'])
+    with pytest.raises(exceptions.BlackListException):
+        asyncio.run(watcher.stream_to_file_async(async_response(SPLIT_CHUNKS), str(tmp_path), 'http://example.com/a.png'))
+    assert list(tmp_path.iterdir()) == []
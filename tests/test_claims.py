@@ -0,0 +1,134 @@
+from types import SimpleNamespace
+from datetime import timedelta
+
+import pytest
+
+import rowdo.config as config
+import rowdo.database
+import rowdo.benchmark.sqlite
+
+WAITING = [rowdo.database.STATUS_WAITING_TO_PROCESS]
+
+pytestmark = pytest.mark.filterwarnings('ignore:Dialect sqlite.*Decimal')
+
+
+@pytest.fixture
+def databases(tmp_path, monkeypatch):
+    """Two nodes sharing one SQLite files table, standing in for MySQL as in the benchmark.
+    """
+    for name in ('CONFIG', '_SNAPSHOT', '_SNAPSHOT_MTIME', '_LOADED'):
+        monkeypatch.setattr(config, name, getattr(config, name))
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / 'config.ini'
+    path.write_text('[database]\nurl = sqlite:///rowdo.db\n[runtime]\ncursor_lag_seconds = 0\n')
+    config.load(str(path))
+    rowdo.benchmark.sqlite.install()
+
+    return rowdo.database.Database(node_id='node-a'), rowdo.database.Database(node_id='node-b', cleanup=False)
+
+
+def seed(db, priorities):
+    """Insert rows a second apart, oldest first, all updated before now.
+
+    Returns:
+        list: Ids of the rows.
+    """
+    first = db.database_now().replace(microsecond=0) - timedelta(seconds=len(priorities) + 1)
+    files = db.get_table('files')
+    session = db.session()
+    rows = [files(url=f'http://example.com/{i}.jpg', priority=priority, created_at=first, updated_at=first + timedelta(seconds=i))
+            for i, priority in enumerate(priorities)]
+    session.add_all(rows)
+    session.commit()
+    ids = [row.id for row in rows]
+    db.close_session()
+    return ids
+
+
+def claim(db, cursor=(None, None), limit=10):
+    return db.claim_file_rows(
+        status=WAITING,
+        last_checked_timestamp=cursor[0],
+        after_id=cursor[1],
+        until=db.database_now() + timedelta(seconds=1),
+        limit=limit,
+        priority_until=db.database_now() + timedelta(seconds=1)
+    )
+
+
+def lane(db, *rows):
+    """Lane rows from (id, priority, seconds waited), in the given order.
+    """
+    now = db.database_now()
+    return [SimpleNamespace(id=row_id, priority=priority, updated_at=now - timedelta(seconds=waited)) for row_id, priority, waited in rows]
+
+
+def test_merge_lanes_takes_higher_priority_first(databases):
+    db, _ = databases
+    default = lane(db, (1, 0, 30), (2, 0, 20), (3, 0, 10))
+    high = lane(db, (4, 5, 5), (5, 5, 1))
+    assert db._merge_lanes([default, high], 3) == ([4, 5, 1], 1)
+
+
+def test_merge_lanes_ages_waiting_rows(databases):
+    db, _ = databases
+    default = lane(db, (1, 0, 300))
+    high = lane(db, (2, 1, 10))
+    assert db._merge_lanes([default, high], 1, aging_seconds=60) == ([1], 1)
+    assert db._merge_lanes([default, high], 1) == ([2], 0)
+
+
+def test_merge_lanes_takes_a_row_of_two_lanes_once(databases):
+    db, _ = databases
+    default = lane(db, (1, 2, 30), (2, 0, 20))
+    high = lane(db, (1, 2, 30))
+    assert db._merge_lanes([default, high], 10) == ([1, 2], 2)
+
+
+def test_merge_lanes_without_rows(databases):
+    db, _ = databases
+    assert db._merge_lanes([[], []], 10) == ([], 0)
+    assert db._merge_lanes([], 10) == ([], 0)
+
+
+def test_cursor_stops_before_rows_left_for_later(databases):
+    db, _ = databases
+    ids = seed(db, [0, 0, 0, 5, 5])
+    rows, cursor = claim(db, limit=3)
+    assert [row.id for row in rows] == [ids[3], ids[4], ids[0]]
+    assert cursor[1] == ids[0]
+
+
+def test_cursor_handoff_between_nodes(databases):
+    db_a, db_b = databases
+    ids = seed(db_a, [0, 0, 0, 0, 0, 5, 5, 5])
+
+    rows_a, cursor = claim(db_a, limit=4)
+    db_a.set_runtime({'last_checked_timestamp': cursor[0], 'last_checked_id': cursor[1]})
+    db_a.flush_writes()
+
+    runtime = db_b.get_runtime()
+    rows_b, _ = claim(db_b, cursor=(runtime.last_checked_timestamp, runtime.last_checked_id))
+
+    claimed_a = {row.id for row in rows_a}
+    claimed_b = {row.id for row in rows_b}
+    assert claimed_a == set(ids[5:]) | {ids[0]}
+    assert claimed_b == set(ids[1:5])
+    assert claim(db_a) == ([], None)
+
+
+def test_rows_claimed_after_the_read_are_not_claimed_again(databases, monkeypatch):
+    db_a, db_b = databases
+    db_a._skip_locked = True  # SQLite renders no FOR UPDATE, the locking query still runs.
+    ids = seed(db_a, [0, 0, 0])
+    merge_lanes = db_a._merge_lanes
+
+    def merge_then_race(*args, **kwargs):
+        merged = merge_lanes(*args, **kwargs)
+        claim(db_b, limit=1)  # Another node claims the oldest row between the read and the lock.
+        return merged
+
+    monkeypatch.setattr(db_a, '_merge_lanes', merge_then_race)
+    rows, cursor = claim(db_a)
+    assert [row.id for row in rows] == ids[1:]
+    assert cursor[1] == ids[2]
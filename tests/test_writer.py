@@ -0,0 +1,62 @@
+from time import sleep
+
+import pytest
+from sqlalchemy import Column, Integer, String, create_engine, select
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+from rowdo.database.writer import WriteBehind
+
+
+Base = declarative_base()
+
+
+class Item(Base):
+    __tablename__ = 'items'
+    id = Column(Integer, primary_key=True)
+    status = Column(Integer, nullable=False, default=0)
+    claimed_by = Column(String(255))
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "writer.db"}', future=True)
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(Item.__table__.insert(), [{'id': 1, 'claimed_by': 'node'}, {'id': 2, 'claimed_by': 'other'}])
+
+    return engine
+
+
+def statuses(engine):
+    with engine.connect() as connection:
+        return dict(connection.execute(select(Item.id, Item.status).order_by(Item.id)).all())
+
+
+def test_batch_size_flushes(engine):
+    writer = WriteBehind(sessionmaker(bind=engine), {'items': Item}, batch_size=2, flush_seconds=60)
+    writer.update('items', 1, {'status': 2})
+    assert statuses(engine) == {1: 0, 2: 0}
+
+    writer.update('items', 2, {'status': 2})
+    assert statuses(engine) == {1: 2, 2: 2}
+
+
+def test_old_writes_are_flushed_without_another_write(engine):
+    writer = WriteBehind(sessionmaker(bind=engine), {'items': Item}, batch_size=100, flush_seconds=0.2)
+    writer.update('items', 1, {'status': 2})
+    assert statuses(engine) == {1: 0, 2: 0}
+
+    for _ in range(50):
+        sleep(0.05)
+        if statuses(engine)[1] == 2:
+            break
+
+    assert statuses(engine) == {1: 2, 2: 0}
+
+
+def test_owned_updates_skip_rows_claimed_by_others(engine):
+    writer = WriteBehind(sessionmaker(bind=engine), {'items': Item}, batch_size=100, flush_seconds=60)
+    writer.update('items', 1, {'status': 2}, owner='node')
+    writer.update('items', 2, {'status': 2}, owner='node')
+    writer.flush()
+    assert statuses(engine) == {1: 2, 2: 0}
@@ -1,5 +1,6 @@
 import sys
 import os
+import multiprocessing
 
 import win32serviceutil  # ServiceFramework and commandline helper
 import win32service  # Events
@@ -62,4 +63,5 @@ def debug_log(s):
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # Worker and image processes of the frozen executable start here.
     init()